@@ -1,19 +1,16 @@
-
 # ARS Canvas v3 (JP UI)
 import streamlit as st
-import sqlite3, re
-import pandas as pd
-from datetime import datetime, timedelta
-from dateutil import tz
-import random, uuid
-from contextlib import contextmanager
-import qrcode
+import uuid, html
 from streamlit_autorefresh import st_autorefresh
 import os
-CREATE_PASS = os.getenv("ARS_CREATE_PASS", "0731")
-import os
 DEFAULT_BASE_URL = os.getenv("ARS_BASE_URL", "https://arsystem.streamlit.app")
-from io import BytesIO
+from db import (init_db, now_ms, hhmm, is_valid_code, ensure_room_by_code, create_room, add_comment,
+                set_focus, tag_comment, untag_comment, hide_comment, search_comments, get_comments,
+                get_room_snapshot, set_room_closed, get_voted_ids, try_vote, set_room_font, set_rotation,
+                comment_rank, room_cache_stats, comment_no, shard_stats)
+from rotation import start_scheduler
+import export
+import profiling as prof
 
 # ---------- Theme & Styles (Focus: readability + friendly spacing) ----------
 PAGE_CSS = """
@@ -37,8 +34,9 @@ header[data-testid="stHeader"]{backdrop-filter: blur(4px);}
 /* Card */
 .ars-card{ border-radius:var(--radius); border:1px solid var(--border);
   background:linear-gradient(180deg,#fff,#fafbfc); box-shadow:0 0 0 1px rgba(0,0,0,0.01), 0 18px 28px -24px rgba(2,6,23,.35);
-  padding: var(--pad);}
+  padding: var(--pad, var(--pad-cozy)); margin-bottom:.5rem;}
 .ars-meta{ color: var(--sub); font-size:.85rem }
+.ars-card mark{ background:#fde68a; color:inherit; padding:0 .1em; border-radius:4px; }
 .ars-chip{ display:inline-block; padding:.25rem .6rem; border-radius:999px; border:1px solid var(--border); background:#fff; margin-right:.35rem; font-size:.8rem;}
 /* Buttons (bigger hit area) */
 button[kind="secondary"], button[kind="primary"]{ padding:.6rem .9rem; border-radius:14px; }
@@ -55,161 +53,11 @@ button[kind="secondary"], button[kind="primary"]{ padding:.6rem .9rem; border-ra
 </style>
 """
 
-# ---------- DB Helpers ----------
-import os
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_DIR = os.path.join(BASE_DIR, "data")
-os.makedirs(DB_DIR, exist_ok=True)
-DB_PATH = os.path.join(DB_DIR, "ars.sqlite")
-
-def _dict_factory(cursor, row):
-    return { col[0]: row[idx] for idx, col in enumerate(cursor.description) }
-
-@contextmanager
-def get_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = _dict_factory
-    try:
-        yield conn
-    finally:
-        conn.commit(); conn.close()
-
-def init_db():
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute("""CREATE TABLE IF NOT EXISTS rooms(
-            code TEXT PRIMARY KEY,
-            title TEXT,
-            created_at TEXT,
-            focus_comment_id INTEGER,
-            admin_pin TEXT,
-            is_closed INTEGER DEFAULT 0,
-            font_scale REAL DEFAULT 1.15
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS comments(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            room_code TEXT,
-            author TEXT,
-            content TEXT,
-            votes INTEGER DEFAULT 0,
-            tags TEXT DEFAULT '',
-            hidden INTEGER DEFAULT 0,
-            created_at TEXT
-        )""")
-        # migrations
-        # comments.hidden
-        cols = [r["name"] for r in c.execute("PRAGMA table_info(comments)").fetchall()]
-        if "hidden" not in cols:
-            c.execute("ALTER TABLE comments ADD COLUMN hidden INTEGER DEFAULT 0")
-        # rooms.font_scale
-        rcols = [r["name"] for r in c.execute("PRAGMA table_info(rooms)").fetchall()]
-        if "font_scale" not in rcols:
-            c.execute("ALTER TABLE rooms ADD COLUMN font_scale REAL DEFAULT 1.15")
-        # votes table
-        c.execute("""CREATE TABLE IF NOT EXISTS votes(
-            room_code TEXT,
-            comment_id INTEGER,
-            voter TEXT,
-            created_at TEXT,
-            PRIMARY KEY (room_code, comment_id, voter)
-        )""")
-
-def is_valid_code(code:str)->bool:
-    return bool(re.fullmatch(r"\d{6}", code or ""))
-
-def ensure_room_by_code(code):
-    with get_db() as conn:
-        return conn.cursor().execute("SELECT * FROM rooms WHERE code=?", (code,)).fetchone()
-
-def create_room(title, admin_pin=None, code=None, creator_pass=None):
-    if (creator_pass or "") != CREATE_PASS:
-        raise ValueError("作成パスワードが正しくありません。")
-    if code and not is_valid_code(code): raise ValueError("ルームIDは6桁の数字です。")
-    code = code or ''.join(random.choices('0123456789', k=6))
-    with get_db() as conn:
-        c = conn.cursor()
-        if ensure_room_by_code(code): raise ValueError("そのルームIDは使用中です。")
-        c.execute("INSERT INTO rooms(code,title,created_at,admin_pin) VALUES(?,?,?,?)",
-                  (code, title or "Session", datetime.utcnow().isoformat(), admin_pin or ""))
-    return code
-
-def add_comment(room_code, author, content):
-    if not content or not content.strip(): return
-    with get_db() as conn:
-        c = conn.cursor()
-        r = c.execute("SELECT is_closed FROM rooms WHERE code=?", (room_code,)).fetchone()
-        if not r or int(r["is_closed"])==1: return
-        c.execute("""INSERT INTO comments(room_code, author, content, created_at)
-                     VALUES(?,?,?,?)""", (room_code, author or "", content.strip(), datetime.utcnow().isoformat()))
-
-def vote_comment(comment_id, delta=1):
-    with get_db() as conn:
-        conn.cursor().execute("UPDATE comments SET votes = COALESCE(votes,0)+? WHERE id=?", (delta, comment_id))
-
-def set_focus(room_code, comment_id):
-    with get_db() as conn:
-        conn.cursor().execute("UPDATE rooms SET focus_comment_id=? WHERE code=?", (comment_id, room_code))
-
-def tag_comment(comment_id, tag):
-    with get_db() as conn:
-        c = conn.cursor()
-        row = c.execute("SELECT tags FROM comments WHERE id=?", (comment_id,)).fetchone()
-        if not row: return
-        tags = [t for t in (row["tags"] or "").split(",") if t]
-        if tag and tag not in tags: tags.append(tag)
-        c.execute("UPDATE comments SET tags=? WHERE id=?", (",".join(tags), comment_id))
-
-def hide_comment(comment_id, hide=True):
-    with get_db() as conn:
-        conn.cursor().execute("UPDATE comments SET hidden=? WHERE id=?", (1 if hide else 0, comment_id))
-
-def get_comments(room_code, keyword=None, include_hidden=False):
-    with get_db() as conn:
-        c = conn.cursor()
-        sql = "SELECT * FROM comments WHERE room_code=?"
-        args = [room_code]
-        if not include_hidden: sql += " AND hidden=0"
-        if keyword:
-            sql += " AND content LIKE ?"; args.append(f"%{keyword}%")
-        sql += " ORDER BY votes DESC, created_at DESC"
-        return c.execute(sql, tuple(args)).fetchall()
-
-def get_room(room_code):
-    with get_db() as conn:
-        return conn.cursor().execute("SELECT * FROM rooms WHERE code=?", (room_code,)).fetchone()
-
-def set_room_closed(room_code, closed:bool):
-    with get_db() as conn:
-        conn.cursor().execute("UPDATE rooms SET is_closed=? WHERE code=?", (1 if closed else 0, room_code))
-
-
-def has_voted(room_code, comment_id, voter):
-    with get_db() as conn:
-        c = conn.cursor()
-        row = c.execute("SELECT 1 FROM votes WHERE room_code=? AND comment_id=? AND voter=?",
-                        (room_code, comment_id, voter)).fetchone()
-        return row is not None
-
-def try_vote(room_code, comment_id, voter):
-    # returns True if vote recorded, False if duplicate
-    if not voter: return False
-    with get_db() as conn:
-        c = conn.cursor()
-        try:
-            c.execute("INSERT INTO votes(room_code, comment_id, voter, created_at) VALUES(?,?,?,?)",
-                      (room_code, comment_id, voter, datetime.utcnow().isoformat()))
-            c.execute("UPDATE comments SET votes = COALESCE(votes,0)+1 WHERE id=?", (comment_id,))
-            return True
-        except Exception:
-            return False
-
-def set_room_font(room_code, scale:float):
-    with get_db() as conn:
-        conn.cursor().execute("UPDATE rooms SET font_scale=? WHERE code=?", (float(scale), room_code))
-
 # ---------- App ----------
+prof.begin_rerun()   # no-op unless profiling is on (ARS_PROFILE=1 or 診断 tab)
 st.set_page_config(page_title="ARS Canvas v3", page_icon="💬", layout="wide")
 init_db()
+start_scheduler()
 st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 # --- role forcing via query params ---
@@ -228,7 +76,7 @@ lock_forced = str(lock_flag).lower() in ("1","true","yes")
 if "user_id" not in st.session_state:
     st.session_state.user_id = str(uuid.uuid4())
 if "last_refresh" not in st.session_state:
-    st.session_state.last_refresh = datetime.utcnow().isoformat()
+    st.session_state.last_refresh = now_ms()
 
 # Role & global UI
 st.sidebar.header("ARS Canvas v3")
@@ -239,7 +87,7 @@ if forced_mode and lock_forced:
 else:
     default_idx = {"参加者":0,"司会者":1,"プロジェクター":2}.get(forced_mode, 0)
     mode = st.sidebar.radio("ロール", ["参加者", "司会者", "プロジェクター"], index=default_idx, horizontal=True)
-
+prof.set_role({"参加者":"participant", "司会者":"organizer", "プロジェクター":"projector"}[mode])
 
 hc = st.sidebar.toggle("高コントラスト（プロジェクター向け）", value=False)
 font_scale_local = st.sidebar.slider("文字サイズ（ローカル）", 0.9, 1.7, 1.15, 0.05)
@@ -248,7 +96,8 @@ density = st.sidebar.selectbox("表示密度", ["Comfy","Cozy","Compact"], index
 pad = {"Comfy":"var(--pad-comfy)","Cozy":"var(--pad-cozy)","Compact":"var(--pad-compact)"}[density]
 cols = st.sidebar.slider("グリッド列（参加者のグリッド表示）", 1, 3, 2)
 
-effective_scale = (get_room(st.session_state.get("room_code", "")) or {}).get("font_scale", 1.15)
+snap = get_room_snapshot(st.session_state.get("room_code", ""))
+effective_scale = (snap["room"] if snap else {}).get("font_scale", 1.15)
 font_scale = effective_scale if follow_org else font_scale_local
 st.markdown(f'<div class="{"high-contrast" if hc else ""}" style="font-size:{font_scale}rem; --pad:{pad}; --cols:{cols};">',
             unsafe_allow_html=True)
@@ -289,10 +138,17 @@ if not room_code:
     st.info("ルームを作成または参加してください。")
     st.stop()
 
-room = get_room(room_code)
+# one shared, cached snapshot per room (see db.get_room_snapshot)
+snap = get_room_snapshot(room_code)
+room = snap["room"] if snap else None
 if not room:
     st.error("そのルームは存在しません。"); st.stop()
 
+# st.fragment (1.37+) / st.experimental_fragment (1.33–1.36); without it only full-page refresh is available
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+prof.lap("sidebar")
+
 # Sticky header
 with st.container():
     st.markdown('<div class="sticky-tools">', unsafe_allow_html=True)
@@ -304,20 +160,40 @@ with st.container():
         sort = st.segmented_control("ソート", options=["人気順","新着"], default="人気順")
     with top_right:
         refresh_ms = st.slider("自動更新(ms)", 1000, 5000, 2000, 250, help="会場では 2000ms 推奨")
+        watch_changes = bool(fragment) and st.toggle("変更時のみ更新", value=True,
+                                                     help="ルームに変化があった時だけ画面全体を更新します（OFFで毎回全体を更新）")
     st.markdown('</div>', unsafe_allow_html=True)
 
 # QR absolute link builder
-with st.expander("参加用URLとQR"):
-    link_p = f"{DEFAULT_BASE_URL}/?room={room_code}&view=p&lock=1"
-    link_o = f"{DEFAULT_BASE_URL}/?room={room_code}&view=o"
-    link_j = f"{DEFAULT_BASE_URL}/?room={room_code}&view=j&lock=1"
+QR_CACHE_SIZE = int(os.getenv("ARS_QR_CACHE_SIZE", "128"))   # rendered codes kept, least recent evicted
 
-    st.markdown("**参加者用URL（ロール固定）**")
-    st.text_input("Participant URL", value=link_p, disabled=True)
+def room_link(base_url, code, view):
+    return f"{base_url}/?room={code}&view={view}" + ("&lock=1" if view in ("p", "j") else "")
+
+@st.cache_resource(max_entries=QR_CACHE_SIZE, show_spinner=False)
+def qr_img(base_url, code, view, width=180):
+    # the link's QR code as an inline PNG <img>, rendered once per process for every session.
+    # qrcode/Pillow load on first use; st.image is avoided because it imports numpy.
+    import qrcode, base64
     from io import BytesIO
     buf = BytesIO()
-    qrcode.make(link_p).save(buf, format="PNG"); buf.seek(0)
-    st.image(buf, caption="参加者用QR（開くと自動で参加者モード）", width=180)
+    qrcode.make(room_link(base_url, code, view)).save(buf, format="PNG")
+    return f'<img src="data:image/png;base64,{base64.b64encode(buf.getvalue()).decode()}" width="{width}" alt="QR">'
+
+try:   # an expander that reports whether it is open (newer Streamlit): no QR while collapsed
+    links = st.expander("参加用URLとQR", key="links", on_change="rerun")
+except TypeError:
+    links = st.expander("参加用URLとQR")
+with links:
+    link_p = room_link(DEFAULT_BASE_URL, room_code, "p")
+    link_o = room_link(DEFAULT_BASE_URL, room_code, "o")
+    link_j = room_link(DEFAULT_BASE_URL, room_code, "j")
+
+    st.markdown("**参加者用URL（ロール固定）**")
+    st.text_input("Participant URL", value=link_p, disabled=True)
+    if getattr(links, "open", None) is not False:
+        st.markdown(qr_img(DEFAULT_BASE_URL, room_code, "p") + '<div class="ars-meta">参加者用QR（開くと自動で参加者モード）</div>',
+                    unsafe_allow_html=True)
 
     st.markdown("**司会者用URL（PIN必須）**")
     st.text_input("Organizer URL", value=link_o, disabled=True)
@@ -332,9 +208,12 @@ with st.expander("参加用URLとQR"):
 3. もしトップに来た場合は、左の **参加ID** に **{room_code}** を入力してください
 """)
 
-# Auto refresh & last refresh tracking
-st_autorefresh(interval=refresh_ms, key="refresh")
-last_seen = pd.to_datetime(st.session_state.last_refresh)
+prof.lap("header")
+
+# Auto refresh & last refresh tracking (change-driven mode: see watch_room at the end)
+if not watch_changes:
+    st_autorefresh(interval=refresh_ms, key="refresh")
+last_seen = st.session_state.last_refresh   # epoch ms; 🆕 marks comments newer than this
 # Admin PIN helper
 def is_admin_ok():
     if not room.get("admin_pin"): return True
@@ -347,46 +226,86 @@ def is_admin_ok():
             st.sidebar.error("PINが違います")
     return st.session_state.get("pin_ok", False)
 
+# Vote state: loaded once per room with a single query, then kept in session and updated locally
+def my_votes(code):
+    cache = st.session_state.setdefault("my_votes", {})
+    if code not in cache:
+        cache[code] = get_voted_ids(code, st.session_state.user_id)
+    return cache[code]
+
+def cast_vote(code, comment_id):
+    if try_vote(code, comment_id, st.session_state.user_id):
+        my_votes(code).add(comment_id)
+
+
+def room_comments(code, keyword=None, include_hidden=False, newest=False, tag=None):
+    # keyword: full-text search in the list's order (popular or newest), rows carry "highlighted" text
+    # tag: only comments with that tag (filtered in SQL)
+    if keyword:
+        return search_comments(code, keyword, include_hidden=include_hidden, mark=HIGHLIGHT,
+                               order="new" if newest else "votes", tag=tag)
+    if tag:
+        return get_comments(code, include_hidden=include_hidden, order="new" if newest else "votes", tag=tag)
+    s = get_room_snapshot(code)
+    if not s: return []
+    return s[("comments" if include_hidden else "visible") + ("_new" if newest else "")]
+
+# ---------- Cards ----------
+# A card's read-only part (text, badge, meta, tags) is one HTML element; only the controls next
+# to it are widgets. Lists are windowed: PAGE_SIZE cards first, "もっと見る" adds a page.
+PAGE_SIZE = 30
+HIGHLIGHT = ("\x02", "\x03")   # search-hit markers, rendered as <mark>
+# Times are shown in the viewer's timezone (browser, Streamlit 1.42+) or ARS_TZ
+TZ_NAME = getattr(getattr(st, "context", None), "timezone", None) or os.getenv("ARS_TZ", "Asia/Tokyo")
+
+def card_html(r, badge="", meta_extra=""):
+    text = html.escape(r.get("highlighted", r["content"])).replace(HIGHLIGHT[0], "<mark>").replace(HIGHLIGHT[1], "</mark>")
+    chips = "".join(f'<span class="ars-chip">#{html.escape(t)}</span>' for t in r["tags"])
+    meta = f'👍 {r["votes"]} ・ {hhmm((r["created_ms"] or 0) // 60000, TZ_NAME)}{meta_extra}'
+    return f'<div class="ars-card"><b>{text}</b>{badge}<div class="ars-meta">{meta}</div>{chips}</div>'
+
+def tag_filter(counts, key):
+    # counts: [(tag, n)] from the snapshot; -> selected tag or "" (all)
+    if not counts: return ""
+    n = dict(counts)
+    return st.selectbox("タグ", [""] + [t for t, _ in counts], key=key,
+                        format_func=lambda t: f"#{t}（{n[t]}）" if t else "すべてのタグ")
+
+def show_more(key):
+    st.session_state[key] = st.session_state.get(key, PAGE_SIZE) + PAGE_SIZE
+
+def paged(rows, key):
+    # -> (rows to render, callable drawing the "もっと見る" button or None)
+    shown = st.session_state.get(key, PAGE_SIZE)
+    more = (lambda: st.button(f"もっと見る（残り {len(rows)-shown} 件）", key=f"{key}_btn", use_container_width=True,
+                              on_click=show_more, args=(key,))) if len(rows) > shown else None
+    return rows[:shown], more
+
 # ---------- PARTICIPANT ----------
 if mode == "参加者":
     if room.get("is_closed")==1:
         st.warning("投稿はクローズされています（司会者が再開できます）。")
     left, right = st.columns([2,1])
     with left:
-        kw = st.text_input("キーワード絞り込み", placeholder="例: マイク, 事例, 照明 など")
-        rows = get_comments(room_code, keyword=kw)
-        if sort == "新着":
-            rows = sorted(rows, key=lambda x: x["created_at"], reverse=True)
+        kw = st.text_input("キーワード絞り込み", placeholder="例: マイク, 事例, 照明 など",
+                           help="スペース区切りの語をすべて含むコメント。3文字以上の語は索引で高速に検索します")
+        tag = tag_filter(snap["tag_counts"]["visible"], "tag_p")
+        rows = room_comments(room_code, keyword=kw, newest=(sort == "新着"), tag=tag)
 
-        # List or Grid
+        # List or Grid: same cards, grid deals them round-robin into columns
         use_grid = st.toggle("グリッド表示", value=(cols>1))
-        new_badge = lambda created: " 🆕" if pd.to_datetime(created) > last_seen else ""
-        if use_grid and cols>1:
-            st.markdown('<div class="grid">', unsafe_allow_html=True)
-            for r in rows[:300]:
-                st.markdown(f'<div class="ars-card">', unsafe_allow_html=True)
-                st.markdown(f'**{r["content"]}**{new_badge(r["created_at"])}')
-                meta = f'👍 {r["votes"]} ・ {pd.to_datetime(r["created_at"]).strftime("%H:%M")}'
-                st.markdown(f'<div class="ars-meta">{meta}</div>', unsafe_allow_html=True)
-                if r["tags"]:
-                    for t in r["tags"].split(","):
-                        st.markdown(f'<span class="ars-chip">#{t}</span>', unsafe_allow_html=True)
-                already = has_voted(room_code, r['id'], st.session_state.user_id)
-                st.button(f'👍 {r["votes"]}' if not already else '投票済', key=f"up_{r['id']}", disabled=already, on_click=lambda: (try_vote(room_code, r['id'], st.session_state.user_id), st.rerun()))
-                st.markdown('</div>', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-        else:
-            for r in rows[:300]:
-                st.markdown(f'<div class="ars-card">', unsafe_allow_html=True)
-                st.markdown(f'**{r["content"]}**{new_badge(r["created_at"])}')
-                meta = f'👍 {r["votes"]} ・ {pd.to_datetime(r["created_at"]).strftime("%H:%M")}'
-                st.markdown(f'<div class="ars-meta">{meta}</div>', unsafe_allow_html=True)
-                if r["tags"]:
-                    for t in r["tags"].split(","):
-                        st.markdown(f'<span class="ars-chip">#{t}</span>', unsafe_allow_html=True)
-                already = has_voted(room_code, r['id'], st.session_state.user_id)
-                st.button(f'👍 {r["votes"]}' if not already else '投票済', key=f"up_{r['id']}", disabled=already, on_click=lambda: (try_vote(room_code, r['id'], st.session_state.user_id), st.rerun()))
-                st.markdown('</div>', unsafe_allow_html=True)
+        new_badge = lambda created: " 🆕" if (created or 0) > last_seen else ""
+        voted = my_votes(room_code)
+        page, more = paged(rows[:300], "shown_p")
+        slots = st.columns(cols) if use_grid and cols>1 else [st.container()]
+        for i, r in enumerate(page):
+            with slots[i % len(slots)]:
+                st.markdown(card_html(r, new_badge(r["created_ms"])), unsafe_allow_html=True)
+                already = r["id"] in voted
+                st.button(f'👍 {r["votes"]}' if not already else '投票済', key=f"up_{r['id']}", disabled=already, on_click=cast_vote, args=(room_code, r["id"]))
+        if more: more()
+
+    prof.lap("cards")
 
     with right:
         st.markdown("### 投稿")
@@ -397,70 +316,83 @@ if mode == "参加者":
             if submitted:
                 add_comment(room_code, author, content)
                 st.success("送信しました")
-                st.session_state.last_refresh = datetime.utcnow().isoformat()
+                st.session_state.last_refresh = now_ms()
                 st.rerun()
+    prof.lap("compose")
 
 # ---------- ORGANIZER ----------
 elif mode == "司会者":
     if not is_admin_ok(): st.stop()
 
-    tabs = st.tabs(["キュー", "クラスタ", "ルーム設定"])
+    try:   # tabs that report which one is open (newer Streamlit): the cluster tab idles until opened
+        tabs = st.tabs(["キュー", "クラスタ", "ルーム設定", "診断"], key="org_tabs", on_change="rerun")
+    except TypeError:
+        tabs = st.tabs(["キュー", "クラスタ", "ルーム設定", "診断"])
 
     with tabs[0]:
         kw = st.text_input("フィルタ", placeholder="キーワードで絞り込み")
-        rows = get_comments(room_code, keyword=kw, include_hidden=True)
-        if sort == "新着":
-            rows = sorted(rows, key=lambda x: x["created_at"], reverse=True)
+        tag = tag_filter(snap["tag_counts"]["all"], "tag_o")
+        rows = room_comments(room_code, keyword=kw, include_hidden=True, newest=(sort == "新着"), tag=tag)
 
-        for r in rows[:400]:
-            st.markdown(f'<div class="ars-card">', unsafe_allow_html=True)
+        voted = my_votes(room_code)
+        page, more = paged(rows[:400], "shown_o")
+        for r in page:
             c1, c2, c3, c4, c5 = st.columns([8,1,1,2,2])
             with c1:
-                hidden_mark = "（非表示）" if r["hidden"]==1 else ""
-                st.markdown(f'**{r["content"]}** {hidden_mark}')
-                if r["tags"]:
-                    for t in r["tags"].split(","):
-                        st.markdown(f'<span class="ars-chip">#{t}</span>', unsafe_allow_html=True)
-                st.caption(f'👍 {r["votes"]} ・ {pd.to_datetime(r["created_at"]).strftime("%H:%M")} ・ ID {r["id"]}')
+                hidden_mark = " （非表示）" if r["hidden"]==1 else ""
+                rank = comment_rank(room_code, r["id"])
+                st.markdown(card_html(r, hidden_mark, f' ・ ID {comment_no(r["id"])}' + (f' ・ {rank}位' if rank else "")), unsafe_allow_html=True)
             with c2:
                 if st.button("Focus", key=f"fc_{r['id']}"):
                     set_focus(room_code, r["id"]); st.toast("フォーカスしました")
             with c3:
-                already = has_voted(room_code, r['id'], st.session_state.user_id)
-                st.button(f"👍 {r['votes']}" if not already else '投票済', key=f"up_org_{r['id']}", disabled=already, on_click=lambda: (try_vote(room_code, r['id'], st.session_state.user_id), st.rerun()))
+                already = r["id"] in voted
+                st.button(f"👍 {r['votes']}" if not already else '投票済', key=f"up_org_{r['id']}", disabled=already, on_click=cast_vote, args=(room_code, r["id"]))
             with c4:
-                tag = st.text_input("タグ", key=f"tg_{r['id']}", label_visibility="collapsed", placeholder="タグ追加")
-                if st.button("＋", key=f"tg_btn_{r['id']}"):
-                    if tag.strip(): tag_comment(r["id"], tag.strip()); st.rerun()
+                new_tag = st.text_input("タグ", key=f"tg_{r['id']}", label_visibility="collapsed", placeholder="タグ追加")
+                # removal picks from the card's own tags
+                old_tag = st.selectbox("削除するタグ", r["tags"], key=f"tg_sel_{r['id']}", label_visibility="collapsed",
+                                       format_func=lambda t: f"#{t}") if r["tags"] else None
+                t1, t2 = st.columns(2)
+                if t1.button("＋", key=f"tg_btn_{r['id']}"):
+                    if tag_comment(r["id"], new_tag): st.rerun()
+                if t2.button("−", key=f"tg_rm_{r['id']}", disabled=not r["tags"]):
+                    if untag_comment(r["id"], old_tag): st.rerun()
+                    st.toast("タグを削除できませんでした")
             with c5:
                 toggle = st.toggle("非表示", value=(r["hidden"]==1), key=f"hd_{r['id']}")
                 if toggle != (r["hidden"]==1):
                     hide_comment(r["id"], toggle); st.rerun()
-            st.markdown('</div>', unsafe_allow_html=True)
+        if more: more()
+
+    prof.lap("queue")
 
     with tabs[1]:
-        st.caption("TF-IDF + KMeans でテーマを把握（最大6クラスタ）")
-        try:
-            from sklearn.feature_extraction.text import TfidfVectorizer
-            from sklearn.cluster import KMeans
-            df = pd.DataFrame(get_comments(room_code, include_hidden=False))
-            if df.empty:
-                st.info("まだコメントがありません。")
-            else:
-                vec = TfidfVectorizer(max_features=5000, stop_words=None)
-                X = vec.fit_transform(df["content"].tolist())
-                k = min(6, max(2, int(len(df)/4)))
-                model = KMeans(n_clusters=k, n_init=10, random_state=42)
-                df["cluster"] = model.fit_predict(X)
-                for cid in sorted(df["cluster"].unique()):
-                    st.markdown(f"#### クラスタ {cid}")
-                    sub = df[df["cluster"]==cid].sort_values("votes", ascending=False).head(6)
-                    for _, r in sub.iterrows():
-                        st.markdown(f'<div class="ars-card">{r["content"]} <span class="ars-chip">👍 {int(r["votes"])}</span></div>', unsafe_allow_html=True)
-        except Exception as e:
-            st.warning(f"クラスタリングは現在利用できません: {e}")
+        st.caption("文字n-gram + MiniBatchKMeans でテーマを把握（最大6クラスタ・バックグラウンドで更新）")
+        # closed: no clustering (and no scikit-learn import) for organizers who never look here
+        if getattr(tabs[1], "open", None) is not False:
+            try:
+                from clustering import latest_clusters
+                rows = room_comments(room_code)
+                res, err = latest_clusters(room_code, snap["revision"], rows)
+                if err: st.warning(f"クラスタリングは現在利用できません: {err}")
+                if not rows:
+                    st.info("まだコメントがありません。")
+                elif res is None:
+                    st.info("クラスタを計算中です…")
+                else:
+                    if res["revision"] != snap["revision"]: st.caption("更新中（前回の結果を表示しています）")
+                    groups = {}
+                    for r in rows:   # popularity order
+                        cid = res["labels"].get(r["id"])
+                        if cid is not None: groups.setdefault(cid, []).append(r)
+                    for cid in sorted(groups):
+                        st.markdown(f"#### クラスタ {cid}")
+                        st.markdown("".join(card_html(r) for r in groups[cid][:6]), unsafe_allow_html=True)
+            except Exception as e:
+                st.warning(f"クラスタリングは現在利用できません: {e}")
+    prof.lap("clusters")
 
-    
     with tabs[2]:
             c1, c2, c3 = st.columns(3)
             with c1:
@@ -475,23 +407,82 @@ elif mode == "司会者":
                 st.caption("共有は ?room=CODE のURLを配布してください")
 
             st.markdown("#### 表示設定（参加者に同期）")
-            current_scale = (get_room(room_code) or {}).get("font_scale", 1.15)
+            current_scale = room.get("font_scale", 1.15)
             new_scale = st.slider("参加者の文字サイズ（全端末に反映）", 0.9, 1.7, float(current_scale), 0.05)
             if st.button("適用（2秒以内に全端末へ反映）"):
                 set_room_font(room_code, new_scale)
                 st.success("フォントサイズを更新しました（参加者が同期ONの場合）")
                 st.rerun()
 
+            st.markdown("#### プロジェクターの自動ローテーション")
+            rot = snap["rotation"] or {}
+            with st.form("rotation"):
+                rc1, rc2, rc3 = st.columns(3)
+                with rc1: rot_on = st.toggle("人気順を自動表示", value=bool(rot.get("enabled")))
+                with rc2: rot_interval = st.slider("間隔（秒）", 3, 30, int(rot.get("interval_s") or 8))
+                with rc3: rot_pool = st.slider("対象（人気上位 N 件）", 3, 50, int(rot.get("pool_size") or 20))
+                if st.form_submit_button("適用"):
+                    set_rotation(room_code, rot_on, rot_interval, rot_pool); st.rerun()
+
+            st.markdown("#### エクスポート")
+            st.caption("コメント・タグ・投票（1票1行）をzipに書き出します（サーバーの data/exports にも保存）")
+            formats = ["csv"] + (["parquet"] if export.parquet_available() else [])
+            e1, e2 = st.columns([1, 2])
+            with e1: fmt = st.radio("形式", formats, horizontal=True, format_func=str.upper)
+            with e2:
+                done = None
+                if st.button("書き出す", use_container_width=True):
+                    with st.spinner("書き出し中…"):
+                        done = export.export_room(room_code, fmt=fmt)
+            if done:   # only in the run that wrote it: later reruns don't read the zip again
+                path, counts = done
+                st.caption(" ・ ".join(f"{k} {v}行" for k, v in counts.items()))
+                with open(path, "rb") as f:
+                    st.download_button(f"ダウンロード（{os.path.basename(path)}）", f, file_name=os.path.basename(path),
+                                       mime="application/zip", use_container_width=True)
+    prof.lap("settings")
+
+    with tabs[3]:
+        st.caption("DBヘルパーの呼び出し回数・時間・行数と、画面の描画フェーズ時間をロール別に集計します（プロセス全体の設定）")
+        on = st.toggle("計測を有効にする", value=prof.enabled())
+        if on != prof.enabled():
+            prof.set_enabled(on); st.rerun()
+        stats = prof.stats()
+        if not stats:
+            st.info("計測データはまだありません。有効にして数回更新すると表示されます。")
+        else:
+            roles = sorted({s["role"] for s in stats})
+            preferred = [r for r in ("participant", "organizer", "projector") if r in roles]
+            role = st.selectbox("ロール", roles, index=roles.index(preferred[0]) if preferred else 0)
+            for kind, title in (("rerun", "1回の更新あたり（total/db_ms: ms、db_calls: 回）"), ("phase", "描画フェーズ（ms）"),
+                                ("db", "DBヘルパー（1呼び出しあたり ms、rows: 返した行数の合計）")):
+                rows_k = [{k: v for k, v in s.items() if k not in ("kind", "role")} for s in stats if s["role"]==role and s["kind"]==kind]
+                if rows_k:
+                    st.markdown(f"##### {title}")
+                    st.dataframe(rows_k, hide_index=True, use_container_width=True)
+        st.caption(f"ルームキャッシュ: {room_cache_stats()}")
+        shards = shard_stats()
+        if shards["enabled"]: st.caption(f"ルームファイル: {shards}")
+        d1, d2, d3 = st.columns(3)
+        with d1:
+            if st.button("リセット", use_container_width=True): prof.reset(); st.rerun()
+        with d2:
+            st.download_button("Prometheus形式で保存", prof.prometheus_text(), file_name="ars_metrics.prom",
+                               mime="text/plain", use_container_width=True)
+        with d3:
+            if st.button("ファイルへ書き出し", use_container_width=True):
+                try: st.success(f"書き出しました: {prof.write_prometheus()}")
+                except OSError as e: st.error(f"書き出せませんでした: {e}")
+
 # ---------- PROJECTOR ----------
 
 elif mode == "プロジェクター":
-    r = get_room(room_code)
+    r = room
     colL, colR = st.columns([4,1])
     with colL:
         focus_id = r.get("focus_comment_id")
         if focus_id:
-            with get_db() as conn:
-                row = conn.cursor().execute("SELECT * FROM comments WHERE id=?", (focus_id,)).fetchone()
+            row = snap["by_id"].get(focus_id)
             if row and row["hidden"]==0:
                 st.markdown('<div class="ars-card ars-focus">', unsafe_allow_html=True)
                 st.markdown(row["content"])
@@ -501,16 +492,41 @@ elif mode == "プロジェクター":
         else:
             st.info("司会者がフォーカスを設定するとここに表示されます。")
     with colR:
+        # read-only: the rotation scheduler (rotation.py) moves the focus, projectors never write
         st.markdown("### ローテーション")
-        auto = st.toggle("人気順を自動表示（8秒ごと）", value=False)
-        if auto:
-            # cycle top 20 comments, excluding hidden
-            rows = get_comments(room_code)
-            if rows:
-                idx = int(datetime.utcnow().timestamp() // 8) % min(20, len(rows))
-                set_focus(room_code, rows[idx]["id"])
+        rot = snap["rotation"]
+        if rot and rot["enabled"]:
+            st.caption(f'人気上位{rot["pool_size"]}件を{rot["interval_s"]:g}秒ごとに自動表示中')
+        else:
+            st.caption("オフ（司会者の「ルーム設定」で設定できます）")
+    prof.lap("projector")
+
+# Change-driven refresh: a tiny fragment polls the room revision (served from the shared
+# snapshot cache) and reruns the whole page only when it moved. Idle rooms are polled less often.
+IDLE_TICKS = 5            # unchanged polls before slowing down
+IDLE_BACKOFF_MAX = 4      # slowest poll = 4x the refresh interval
+
+def change_token(s):
+    # focus moves (Focus button, rotation) only change what the projector shows
+    if not s: return None
+    return (s["revision"], s["room"]["focus_revision"]) if mode == "プロジェクター" else s["revision"]
+
+if watch_changes:
+    rendered = change_token(snap)   # the page was drawn from this snapshot; anything newer reruns it
+    poll = st.session_state.setdefault("poll", {"factor": 1, "idle": 0})
+
+    @fragment(run_every=refresh_ms/1000 * poll["factor"])
+    def watch_room():
+        if change_token(get_room_snapshot(room_code)) != rendered:
+            poll.update(factor=1, idle=0); st.rerun()
+        poll["idle"] += 1
+        if poll["idle"] >= IDLE_TICKS and poll["factor"] < IDLE_BACKOFF_MAX:
+            poll.update(factor=poll["factor"]*2, idle=0); st.rerun()   # re-register at the slower interval
+    watch_room()
+prof.lap("watch")
 
 # Update last_refresh timestamp at end of render
-st.session_state.last_refresh = datetime.utcnow().isoformat()
+st.session_state.last_refresh = now_ms()
 
-st.markdown("</div>", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown("</div>", unsafe_allow_html=True)
+prof.end_rerun()
\ No newline at end of file
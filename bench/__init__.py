@@ -0,0 +1 @@
+# ARS Canvas v3 — benchmarks (see bench/README.md)
@@ -0,0 +1,71 @@
+# Shared helpers: latency stats, report table, saved baselines
+import os, json, math, tempfile, platform, sys
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+def temp_db_path(prefix="ars-bench-"):
+    # fresh SQLite file per run, in its own directory (room files go next to it with
+    # ARS_SHARDING=1); must be set as ARS_DB_PATH before `import db`
+    return os.path.join(tempfile.mkdtemp(prefix=prefix), "ars.sqlite")
+
+def percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    i = min(len(sorted_values)-1, max(0, math.ceil(p/100 * len(sorted_values)) - 1))
+    return sorted_values[i]
+
+def summarize(samples, seconds):
+    # samples: {name: [latency seconds]} -> {name: {"count", "per_s", "p50_ms", "p95_ms", "p99_ms"}}
+    out = {}
+    for name, values in sorted(samples.items()):
+        v = sorted(values)
+        out[name] = {"count": len(v), "per_s": round(len(v)/seconds, 1) if seconds else 0.0,
+                     "p50_ms": round(percentile(v, 50)*1000, 3), "p95_ms": round(percentile(v, 95)*1000, 3),
+                     "p99_ms": round(percentile(v, 99)*1000, 3)}
+    return out
+
+def print_table(stats, title=""):
+    if title: print(f"\n{title}")
+    print(f'{"operation":<28}{"count":>9}{"ops/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for name, s in stats.items():
+        print(f'{name:<28}{s["count"]:>9}{s["per_s"]:>10}{s["p50_ms"]:>10}{s["p95_ms"]:>10}{s["p99_ms"]:>10}')
+
+def environment():
+    import sqlite3
+    return {"python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def save_baseline(name, params, stats):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "env": environment(), "stats": stats}, f, indent=2, ensure_ascii=False)
+    return path
+
+def compare_baseline(name, stats, tolerance):
+    # -> list of regression messages: p95 slower, or throughput lower, by more than `tolerance`
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, encoding="utf-8") as f:
+        base = json.load(f)["stats"]
+    problems = []
+    for op, s in stats.items():
+        b = base.get(op)
+        if not b: continue
+        if b["p95_ms"] and s["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            problems.append(f'{op}: p95 {s["p95_ms"]}ms > baseline {b["p95_ms"]}ms')
+        if b["per_s"] and s["per_s"] < b["per_s"] * (1 - tolerance):
+            problems.append(f'{op}: {s["per_s"]} ops/s < baseline {b["per_s"]} ops/s')
+    return problems
+
+def add_baseline_args(parser):
+    parser.add_argument("--save", metavar="NAME", help="save results as bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with bench/baselines/NAME.json; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression ratio (default 0.25)")
+
+def finish(args, params, stats):
+    if args.save:
+        print(f"\nbaseline saved: {save_baseline(args.save, params, stats)}")
+    if args.compare:
+        problems = compare_baseline(args.compare, stats, args.tolerance)
+        for p in problems: print("REGRESSION", p)
+        if problems: sys.exit(1)
+        print(f"\nno regression against {args.compare} (tolerance {args.tolerance:.0%})")
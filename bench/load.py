@@ -0,0 +1,130 @@
+# Auditorium load test against the data layer (db.py)
+#   python -m bench.load --participants 400 --organizers 2 --projectors 2 --seconds 30
+#   python -m bench.load --save local        # record a baseline
+#   python -m bench.load --compare local     # fail (exit 1) if p95/throughput regressed
+import argparse, os, random, threading, time, uuid
+import multiprocessing as mp
+from bench.common import temp_db_path, summarize, print_table, add_baseline_args, finish
+
+PHRASES = ["マイクの音量が小さいです", "スライドをもう一度見せてください", "照明が暗いです", "事例を詳しく",
+           "休憩はありますか", "資料はどこで見られますか", "Q&Aの時間はありますか", "音声が途切れます"]
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.load",
+                                description="Auditorium load test against the data layer (db.py)")
+    p.add_argument("--participants", type=int, default=300)
+    p.add_argument("--organizers", type=int, default=2)
+    p.add_argument("--projectors", type=int, default=2)
+    p.add_argument("--seconds", type=float, default=20)
+    p.add_argument("--refresh", type=float, default=2.0, help="seconds between a client's refreshes (0: flat out)")
+    p.add_argument("--comments", type=int, default=200, help="comments seeded before the run")
+    p.add_argument("--post-rate", type=float, default=0.02, help="chance a participant posts per refresh")
+    p.add_argument("--vote-rate", type=float, default=0.10, help="chance a participant votes per refresh")
+    p.add_argument("--processes", type=int, default=1, help="spread clients over N processes (same DB file)")
+    p.add_argument("--db", help="SQLite file to use (default: a fresh temp file)")
+    p.add_argument("--seed", type=int, default=42)
+    add_baseline_args(p)
+    return p.parse_args(argv)
+
+class Recorder:
+    def __init__(self): self.samples = {}
+    def timed(self, name, fn, *args, **kw):
+        t0 = time.perf_counter()
+        try: return fn(*args, **kw)
+        finally: self.samples.setdefault(name, []).append(time.perf_counter() - t0)
+
+def _participant(db, code, rec, args, deadline, rnd):
+    uid = str(uuid.uuid4())
+    rec.timed("participant.voted_ids", db.get_voted_ids, code, uid)
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        snap = rec.timed("participant.snapshot", db.get_room_snapshot, code)
+        if rnd.random() < args.post_rate:
+            rec.timed("add_comment", db.add_comment, code, "", rnd.choice(PHRASES) + f" {rnd.randint(0, 999)}")
+        if snap and snap["visible"] and rnd.random() < args.vote_rate:
+            target = rnd.choice(snap["visible"][:50])["id"]
+            rec.timed("try_vote", db.try_vote, code, target, uid)
+        rec.samples.setdefault("participant.refresh", []).append(time.perf_counter() - t0)
+        time.sleep(args.refresh * rnd.uniform(0.8, 1.2))
+
+def _organizer(db, code, rec, args, deadline, rnd):
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        rows = rec.timed("organizer.get_comments", db.get_comments, code, include_hidden=True)
+        if rnd.random() < 0.3:
+            rec.timed("organizer.search", db.search_comments, code, rnd.choice(["マイク", "スライド", "照明"]))
+        if rows and rnd.random() < 0.1:
+            rec.timed("tag_comment", db.tag_comment, rnd.choice(rows)["id"], rnd.choice(["質問", "要対応"]))
+        if rows and rnd.random() < 0.05:
+            r = rnd.choice(rows); rec.timed("hide_comment", db.hide_comment, r["id"], not r["hidden"])
+        rec.samples.setdefault("organizer.refresh", []).append(time.perf_counter() - t0)
+        time.sleep(args.refresh * rnd.uniform(0.8, 1.2))
+
+def _projector(db, code, rec, args, deadline, rnd):
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        rec.timed("projector.snapshot", db.get_room_snapshot, code)
+        rec.timed("top_comments", db.top_comments, code, 20)
+        rec.samples.setdefault("projector.refresh", []).append(time.perf_counter() - t0)
+        time.sleep(args.refresh * rnd.uniform(0.8, 1.2))
+
+def run_clients(args, code, share, index, out=None):
+    # runs this process's share of clients as threads; returns {op: [seconds]}
+    import db
+    roles = [(_participant, share[0]), (_organizer, share[1]), (_projector, share[2])]
+    deadline = time.time() + args.seconds
+    recorders, threads = [], []
+    for fn, n in roles:
+        for i in range(n):
+            rec = Recorder(); recorders.append(rec)
+            rnd = random.Random(f"{args.seed}-{index}-{fn.__name__}-{i}")
+            threads.append(threading.Thread(target=fn, args=(db, code, rec, args, deadline, rnd), daemon=True))
+    for t in threads: t.start()
+    for t in threads: t.join()
+    db.flush_votes()
+    merged = {}
+    for rec in recorders:
+        for k, v in rec.samples.items(): merged.setdefault(k, []).extend(v)
+    if out is not None: out.put(merged)
+    return merged
+
+def _split(n, parts, i):
+    return n // parts + (1 if i < n % parts else 0)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["ARS_DB_PATH"] = args.db or temp_db_path()
+    import db
+    db.init_db()
+    rnd = random.Random(args.seed)
+    code = db.create_room("bench", creator_pass=db.CREATE_PASS)
+    for _ in range(args.comments):
+        db.add_comment(code, "", rnd.choice(PHRASES) + f" {rnd.randint(0, 999)}")
+    counts = (args.participants, args.organizers, args.projectors)
+    print(f"db={os.environ['ARS_DB_PATH']} room={code} participants={counts[0]} organizers={counts[1]} "
+          f"projectors={counts[2]} processes={args.processes} seconds={args.seconds} refresh={args.refresh}s")
+    t0 = time.time()
+    if args.processes <= 1:
+        samples = run_clients(args, code, counts, 0)
+    else:
+        ctx = mp.get_context("spawn")
+        out = ctx.Queue()
+        procs = [ctx.Process(target=run_clients, args=(args, code, tuple(_split(n, args.processes, i) for n in counts), i, out))
+                 for i in range(args.processes)]
+        for p in procs: p.start()
+        samples = {}
+        for _ in procs:
+            for k, v in out.get().items(): samples.setdefault(k, []).extend(v)
+        for p in procs: p.join()
+    elapsed = time.time() - t0
+    stats = summarize(samples, elapsed)
+    print_table(stats, f"data layer, {elapsed:.1f}s")
+    with db.get_db(room=code) as conn:
+        row = conn.execute("SELECT (SELECT COUNT(*) FROM votes WHERE room_code=?) AS votes, "
+                           "(SELECT COALESCE(SUM(votes),0) FROM comments WHERE room_code=?) AS counted", (code, code)).fetchone()
+    print(f"\nvotes stored {row['votes']}, comment counters {row['counted']}, cache {db.room_cache_stats()}")
+    params = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance", "db")}
+    finish(args, params, stats)
+
+if __name__ == "__main__":
+    main()
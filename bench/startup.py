@@ -0,0 +1,74 @@
+# Cold start per role: every run is a fresh Python process (needs streamlit installed)
+#   python -m bench.startup --runs 5
+#   python -m bench.startup --save local / --compare local
+# Reports, per role: importing Streamlit + AppTest (not ours, for scale), the first render of
+# app.py (module imports, DB init, first page), the next rerun, the peak RSS of the process and
+# which heavy optional modules the first render pulled in.
+import argparse, json, os, subprocess, sys, time
+from bench.common import temp_db_path, summarize, print_table, add_baseline_args, finish
+from bench.ui import APP, ROLES
+
+HEAVY = ("pandas", "sklearn", "scipy", "numpy", "pyarrow", "qrcode", "PIL")
+
+# runs in the child process; argv: app path, room code, view
+CHILD = r"""
+import json, resource, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.query_params.update(room=sys.argv[2], view=sys.argv[3], lock="1")
+at.run()
+t2 = time.perf_counter()
+if at.exception: sys.exit(at.exception[0].message)
+at.run()
+t3 = time.perf_counter()
+print(json.dumps({"import_streamlit": t1 - t0, "first_render": t2 - t1, "rerun": t3 - t2,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.startup",
+                                description="Cold start per role, one fresh Python process per run")
+    p.add_argument("--runs", type=int, default=5, help="fresh processes per role")
+    p.add_argument("--comments", type=int, default=100)
+    p.add_argument("--roles", default=",".join(ROLES), help="comma-separated subset of " + ",".join(ROLES))
+    add_baseline_args(p)
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["ARS_DB_PATH"] = temp_db_path()   # children inherit it
+    import db
+    from bench.load import PHRASES
+    db.init_db()
+    code = db.create_room("bench", creator_pass=db.CREATE_PASS)
+    for i in range(args.comments): db.add_comment(code, "", f"{PHRASES[i % len(PHRASES)]} {i}")
+    db.close_db()
+
+    samples, rss, heavy = {}, {}, {}
+    t_start = time.time()
+    for role in [r.strip() for r in args.roles.split(",") if r.strip()]:
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, "-c", CHILD, APP, code, ROLES[role]],
+                                 capture_output=True, text=True, cwd=os.path.dirname(APP))
+            if out.returncode: raise SystemExit(f"{role}: {out.stderr.strip().splitlines()[-1:]}")
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            for k in ("import_streamlit", "first_render", "rerun"):
+                samples.setdefault(f"{role}.{k}", []).append(r[k])
+            rss.setdefault(role, []).append(r["rss_mb"])
+            heavy[role] = r["heavy"]
+    stats = summarize(samples, time.time() - t_start)
+    print_table(stats, f"cold start, {args.runs} processes per role")
+    print(f'\n{"role":<14}{"peak RSS MB":>12}  heavy modules loaded')
+    for role, v in rss.items():
+        v = sorted(v)
+        print(f'{role:<14}{v[len(v)//2]:>12.1f}  {", ".join(heavy[role]) or "-"}')
+        stats[f"{role}.rss_mb"] = {"count": len(v), "per_s": 0.0, "p50_ms": round(v[len(v)//2], 1),
+                                   "p95_ms": round(v[-1], 1), "p99_ms": round(v[-1], 1)}   # MB, not ms
+    params = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance")}
+    finish(args, params, stats)
+
+if __name__ == "__main__":
+    main()
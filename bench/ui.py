@@ -0,0 +1,56 @@
+# Streamlit rerun timing per role with AppTest (needs streamlit installed)
+#   python -m bench.ui --comments 300 --reruns 20
+#   python -m bench.ui --save local / --compare local
+import argparse, os, random, time
+from bench.common import temp_db_path, summarize, print_table, add_baseline_args, finish
+from bench.load import PHRASES
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+ROLES = {"participant": "p", "organizer": "o", "projector": "j"}
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench.ui",
+                                description="Streamlit rerun timing per role with AppTest")
+    p.add_argument("--comments", type=int, default=300)
+    p.add_argument("--votes", type=int, default=2000, help="votes spread over the seeded comments")
+    p.add_argument("--reruns", type=int, default=20, help="timed reruns per role (after one warm-up run)")
+    p.add_argument("--roles", default=",".join(ROLES), help="comma-separated subset of " + ",".join(ROLES))
+    p.add_argument("--seed", type=int, default=42)
+    add_baseline_args(p)
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["ARS_DB_PATH"] = temp_db_path()
+    import db
+    from streamlit.testing.v1 import AppTest
+    db.init_db()
+    rnd = random.Random(args.seed)
+    code = db.create_room("bench", creator_pass=db.CREATE_PASS)
+    for _ in range(args.comments):
+        db.add_comment(code, "", rnd.choice(PHRASES) + f" {rnd.randint(0, 999)}")
+    ids = [r["id"] for r in db.get_comments(code)]
+    for i in range(args.votes):
+        db.try_vote(code, rnd.choice(ids), f"seed-{i}")
+    db.flush_votes()
+
+    samples, first = {}, {}
+    t_start = time.time()
+    for role in [r.strip() for r in args.roles.split(",") if r.strip()]:
+        at = AppTest.from_file(APP, default_timeout=120)
+        at.query_params.update(room=code, view=ROLES[role], lock="1")
+        t0 = time.perf_counter(); at.run(); first[role] = time.perf_counter() - t0
+        if at.exception: raise SystemExit(f"{role}: {at.exception[0].message}")
+        for _ in range(args.reruns):
+            t0 = time.perf_counter(); at.run()
+            samples.setdefault(f"{role}.rerun", []).append(time.perf_counter() - t0)
+    stats = summarize(samples, time.time() - t_start)
+    for role, sec in first.items():
+        stats[f"{role}.first_run"] = {"count": 1, "per_s": 0.0, "p50_ms": round(sec*1000, 3),
+                                      "p95_ms": round(sec*1000, 3), "p99_ms": round(sec*1000, 3)}
+    print_table(stats, f"AppTest reruns: {args.comments} comments, {args.votes} votes")
+    params = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance")}
+    finish(args, params, stats)
+
+if __name__ == "__main__":
+    main()
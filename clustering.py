@@ -0,0 +1,87 @@
+# ARS Canvas v3 — theme clustering for the organizer tab
+# Runs on a background worker and is cached per room: the tab always shows the last finished
+# result and asks for an update when the room revision moved. Features are hashed character
+# n-grams (stateless, work for Japanese without word splitting), so new comments are vectorized
+# alone and folded into a MiniBatchKMeans model with partial_fit instead of refitting everything.
+import os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import profiling as prof
+
+MAX_CLUSTERS = 6
+MAX_ROOMS = int(os.getenv("ARS_CLUSTER_ROOMS", "16"))   # rooms whose models are kept in memory
+REFIT_RATIO = 0.5   # refit from scratch once this share of the comments arrived after the last fit
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ars-cluster")   # one core at most
+_lock = threading.Lock()
+_models = OrderedDict()   # room_code -> _RoomModel
+
+def _vectorizer():
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(analyzer="char_wb", ngram_range=(2, 3), n_features=2**18,
+                             alternate_sign=False, norm="l2")
+
+def _n_clusters(n):
+    return min(MAX_CLUSTERS, max(2, int(n/4)))
+
+class _RoomModel:
+    def __init__(self):
+        self.km = None
+        self.features = {}     # comment id -> sparse row
+        self.fitted_on = 0     # comments in the last full fit
+        self.result = None     # {"revision", "labels": {comment_id: cluster}, "k", "elapsed_ms"}
+        self.pending = False
+        self.error = None
+
+    def update(self, revision, comments):
+        from scipy.sparse import vstack
+        from sklearn.cluster import MiniBatchKMeans
+        t0 = time.perf_counter()
+        ids = [r["id"] for r in comments]
+        if self.result and set(ids) == set(self.result["labels"]):
+            # votes/tags/focus changed, texts did not: keep the labels
+            self.result = dict(self.result, revision=revision); return
+        new = [r for r in comments if r["id"] not in self.features]
+        if new:
+            X_new = _vectorizer().transform([r["content"] for r in new])
+            for i, r in enumerate(new): self.features[r["id"]] = X_new[i]
+        live = set(ids)
+        self.features = {i: x for i, x in self.features.items() if i in live}
+        if len(ids) < 2:
+            self.km = None
+            self.result = {"revision": revision, "labels": {i: 0 for i in ids}, "k": len(ids), "elapsed_ms": 0.0}
+            return
+        X = vstack([self.features[i] for i in ids])
+        k = _n_clusters(len(ids))
+        if self.km is None or self.km.n_clusters != k or len(ids) - self.fitted_on > self.fitted_on * REFIT_RATIO:
+            self.km = MiniBatchKMeans(n_clusters=k, n_init=3, batch_size=256, random_state=42).fit(X)
+            self.fitted_on = len(ids)
+        elif new:
+            self.km.partial_fit(vstack([self.features[r["id"]] for r in new]))
+        labels = self.km.predict(X)
+        self.result = {"revision": revision, "labels": dict(zip(ids, labels.tolist())), "k": k,
+                       "elapsed_ms": (time.perf_counter() - t0) * 1000}
+
+def _run(model, revision, comments):
+    try:
+        with prof.phase("cluster.update"): model.update(revision, comments)
+        model.error = None
+    except Exception as e:
+        model.error = e
+    finally:
+        with _lock: model.pending = False
+
+def latest_clusters(room_code, revision, comments):
+    # -> (last finished result or None, error or None); schedules a background update when the
+    # result is older than `revision`. `comments` are the room's visible rows (id, content).
+    with _lock:
+        model = _models.get(room_code)
+        if model is None:
+            model = _models[room_code] = _RoomModel()
+            while len(_models) > MAX_ROOMS: _models.popitem(last=False)
+        _models.move_to_end(room_code)
+        stale = model.result is None or model.result["revision"] != revision
+        if stale and not model.pending:
+            model.pending = True
+            _executor.submit(_run, model, revision, list(comments))
+    return model.result, model.error
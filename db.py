@@ -0,0 +1,1117 @@
+# ARS Canvas v3 — data layer (SQLite)
+import sqlite3, re, os, random, threading, atexit, queue, time, json
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from dateutil import tz
+from bisect import bisect_left, insort
+from profiling import timed
+from contextlib import contextmanager
+
+CREATE_PASS = os.getenv("ARS_CREATE_PASS", "0731")
+
+# ---------- Connection pool ----------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_DIR = os.path.join(BASE_DIR, "data")
+DB_PATH = os.getenv("ARS_DB_PATH", os.path.join(DB_DIR, "ars.sqlite"))
+os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+
+POOL_SIZE = int(os.getenv("ARS_DB_POOL_SIZE", "16"))    # idle read connections kept open
+BUSY_TIMEOUT_MS = int(os.getenv("ARS_DB_BUSY_TIMEOUT_MS", "5000"))
+PRAGMAS = (
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous=NORMAL",   # safe with WAL; fsync only on checkpoint
+    "PRAGMA cache_size=-16000",    # ~16MB page cache per connection
+    "PRAGMA mmap_size=268435456",  # 256MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+)
+
+def _dict_factory(cursor, row):
+    return { col[0]: row[idx] for idx, col in enumerate(cursor.description) }
+
+def _connect(path, readonly=False):
+    # isolation_level=None: transactions are opened explicitly by get_db(write=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS/1000, isolation_level=None)
+    conn.row_factory = _dict_factory
+    for p in PRAGMAS: conn.execute(p)
+    if readonly: conn.execute("PRAGMA query_only=1")
+    return conn
+
+class _Pool:
+    # Streamlit script threads are short-lived, so read connections are checked out from a
+    # shared pool rather than pinned to a thread; all writes go through one serialized writer.
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.readers = queue.LifoQueue(maxsize=size)
+        self.write_lock = threading.RLock()
+        self.writer = None
+        self.migrated = False
+        self.closed = False
+
+    def get_writer(self):
+        # caller holds write_lock
+        if self.writer is None:
+            self.writer = _connect(self.path)
+            self.writer.execute("PRAGMA auto_vacuum=INCREMENTAL")   # takes effect on new files only (see compact)
+            self.writer.execute("PRAGMA journal_mode=WAL")
+        return self.writer
+
+    def acquire(self):
+        try: return self.readers.get_nowait()
+        except queue.Empty: pass
+        if self.writer is None:   # enable WAL on a fresh file before the first reader attaches
+            with self.write_lock: self.get_writer()
+        return _connect(self.path, readonly=True)
+
+    def release(self, conn):
+        if self.closed: conn.close(); return   # evicted while checked out
+        try: self.readers.put_nowait(conn)
+        except queue.Full: conn.close()
+
+    def close(self):
+        # never waits: a writer in use is closed by get_db once its transaction ends
+        self.closed = True
+        while True:
+            try: self.readers.get_nowait().close()
+            except queue.Empty: break
+        if not self.write_lock.acquire(blocking=False): return
+        try:
+            if self.writer is not None:
+                self.writer.close(); self.writer = None
+        finally:
+            self.write_lock.release()
+
+# ---------- Per-room shards ----------
+# ARS_SHARDING=1 stores every room in its own file under ARS_SHARD_DIR, so a vote storm in one
+# room no longer queues behind (or blocks) the writer of every other room. The main DB becomes
+# the catalog: the rooms list for code lookup and the projector rotations the scheduler scans.
+# Rooms without a file (created before sharding was switched on) keep living in the main DB.
+# Comment ids of room NNNNNN start at (NNNNNN+1) * SHARD_ID_SPAN, so they stay unique across
+# files and a helper given only a comment id can still find its room (_room_of).
+SHARDING = os.getenv("ARS_SHARDING", "0") == "1"
+SHARD_DIR = os.getenv("ARS_SHARD_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "rooms"))
+SHARD_CACHE_SIZE = int(os.getenv("ARS_SHARD_CACHE_SIZE", "32"))   # room files kept open
+SHARD_POOL_SIZE = int(os.getenv("ARS_SHARD_POOL_SIZE", "4"))      # idle readers per room file
+SHARD_ID_SPAN = 10**9
+
+def shard_path(room_code):
+    return os.path.join(SHARD_DIR, f"{room_code}.sqlite")
+
+class _Shards:
+    # least recently used room files are closed (outside self.lock); a connection checked out of an
+    # evicted pool is closed when it is released, and its writer once the running transaction ends
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.pools = OrderedDict()   # room_code -> _Pool
+        self.stats = {"opens": 0, "evictions": 0}
+
+    def get(self, room_code, create=False):
+        with self.lock:
+            pool = self.pools.get(room_code)
+            if pool is not None:
+                self.pools.move_to_end(room_code); return pool
+            if not create and not os.path.exists(shard_path(room_code)): return None
+            os.makedirs(SHARD_DIR, exist_ok=True)
+            pool = self.pools[room_code] = _Pool(shard_path(room_code), SHARD_POOL_SIZE)
+            self.stats["opens"] += 1
+            evicted = []
+            while len(self.pools) > self.size:
+                evicted.append(self.pools.popitem(last=False)[1]); self.stats["evictions"] += 1
+        for old in evicted: old.close()
+        return pool
+
+    def drop(self, room_code):
+        # forget and close a room's pool (its file is about to be deleted)
+        with self.lock: pool = self.pools.pop(room_code, None)
+        if pool is not None: pool.close()
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = list(self.pools.values()), OrderedDict()
+        for pool in pools: pool.close()
+
+_pool = _Pool(DB_PATH)
+_shards = _Shards(SHARD_CACHE_SIZE)
+atexit.register(_pool.close)
+atexit.register(_shards.close)
+
+def _room_of(comment_id):
+    # shard key of a comment (None for ids of the main DB)
+    if not SHARDING or comment_id is None or int(comment_id) < SHARD_ID_SPAN: return None
+    return f"{int(comment_id) // SHARD_ID_SPAN - 1:06d}"
+
+def _pool_for(room, create=False):
+    if not (SHARDING and room): return _pool
+    pool = _shards.get(room, create)
+    if pool is None: return _pool   # no file for this room: unknown, or kept in the main DB
+    if not pool.migrated: _migrate(pool, room)
+    return pool
+
+def comment_no(comment_id):
+    # short number shown to organizers: the id within its room's range
+    return int(comment_id) % SHARD_ID_SPAN
+
+def shard_stats():
+    with _shards.lock:
+        return dict(_shards.stats, open=len(_shards.pools), enabled=SHARDING)
+
+_tx = threading.local()   # .state: (dirty rooms, changed rows) of the write open on this thread (see _bump)
+
+@contextmanager
+def get_db(write=False, room=None):
+    # room: route to that room's file when sharding is on (the catalog/main DB otherwise)
+    pool = _pool_for(room)
+    if not write:
+        conn = pool.acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction: conn.rollback()
+            pool.release(conn)
+        return
+    with pool.write_lock:
+        conn = pool.get_writer()
+        if conn.in_transaction:   # nested write: join the outer transaction
+            yield conn; return
+        conn.execute("BEGIN IMMEDIATE")
+        outer = getattr(_tx, "state", None)   # a write to another file may be open around this one
+        _tx.state = state = ({}, [])          # room -> [first, last revision] (None: focus only), comment rows; applied after commit
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback(); raise
+        else:
+            conn.commit()
+        finally:
+            _tx.state = outer
+            if pool.closed: pool.close()   # evicted while this write was running
+    # after write_lock is released: the caches take their own locks and may read the DB. Commits
+    # can reach the leaderboards out of order; rows carry their revision, so older ones lose.
+    for code, span in state[0].items():
+        _room_cache.invalidate(code)
+        if span: _leaderboards.committed(code, *span, [r for r in state[1] if r["room_code"] == code])
+
+def close_db():
+    _shards.close()
+    _pool.close()
+
+# ---------- Schema migrations ----------
+# Each step runs once, in order; PRAGMA user_version records how many have been applied.
+def _m001_base(c):
+    c.execute("""CREATE TABLE IF NOT EXISTS rooms(
+        code TEXT PRIMARY KEY,
+        title TEXT,
+        created_at TEXT,
+        focus_comment_id INTEGER,
+        admin_pin TEXT,
+        is_closed INTEGER DEFAULT 0,
+        font_scale REAL DEFAULT 1.15
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS comments(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        room_code TEXT,
+        author TEXT,
+        content TEXT,
+        votes INTEGER DEFAULT 0,
+        tags TEXT DEFAULT '',
+        hidden INTEGER DEFAULT 0,
+        created_at TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS votes(
+        room_code TEXT,
+        comment_id INTEGER,
+        voter TEXT,
+        created_at TEXT,
+        PRIMARY KEY (room_code, comment_id, voter)
+    )""")
+    # columns added before migrations were versioned
+    cols = [r["name"] for r in c.execute("PRAGMA table_info(comments)").fetchall()]
+    if "hidden" not in cols:
+        c.execute("ALTER TABLE comments ADD COLUMN hidden INTEGER DEFAULT 0")
+    rcols = [r["name"] for r in c.execute("PRAGMA table_info(rooms)").fetchall()]
+    if "font_scale" not in rcols:
+        c.execute("ALTER TABLE rooms ADD COLUMN font_scale REAL DEFAULT 1.15")
+
+def _m002_indexes(c):
+    # participant / projector: WHERE room_code=? AND hidden=0 ORDER BY votes DESC, created_at DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_comments_room_visible ON comments(room_code, hidden, votes DESC, created_at DESC)")
+    # organizer (include_hidden): WHERE room_code=? ORDER BY votes DESC, created_at DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_comments_room_votes ON comments(room_code, votes DESC, created_at DESC)")
+    # get_voted_ids: WHERE room_code=? AND voter=?
+    c.execute("CREATE INDEX IF NOT EXISTS idx_votes_room_voter ON votes(room_code, voter, comment_id)")
+
+def _m003_revisions(c):
+    # per-room change counter; each comment remembers the room revision that last touched it
+    c.execute("ALTER TABLE rooms ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE comments ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_comments_room_revision ON comments(room_code, revision)")
+
+# Full-text index over comments.content. The trigram tokenizer matches substrings, so Japanese
+# text without spaces is searchable; it needs SQLite >= 3.34 built with FTS5.
+def _create_fts(c):
+    try:
+        c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+            content, content='comments', content_rowid='id', tokenize='trigram')""")
+    except sqlite3.OperationalError:
+        return False   # no FTS5 / trigram in this build: keyword search falls back to LIKE
+    c.execute("""CREATE TRIGGER IF NOT EXISTS comments_fts_ai AFTER INSERT ON comments BEGIN
+        INSERT INTO comments_fts(rowid, content) VALUES (new.id, new.content); END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS comments_fts_ad AFTER DELETE ON comments BEGIN
+        INSERT INTO comments_fts(comments_fts, rowid, content) VALUES ('delete', old.id, old.content); END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS comments_fts_au AFTER UPDATE OF content ON comments BEGIN
+        INSERT INTO comments_fts(comments_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO comments_fts(rowid, content) VALUES (new.id, new.content); END""")
+    c.execute("INSERT INTO comments_fts(comments_fts) VALUES ('rebuild')")
+    return True
+
+def _has_fts(c):
+    return c.execute("SELECT 1 FROM sqlite_master WHERE name='comments_fts'").fetchone() is not None
+
+def _m004_fts(c):
+    _create_fts(c)
+
+def _m005_epoch_ms(c):
+    # created_ms: integer epoch milliseconds (UTC). Rows written before this keep their ISO
+    # created_at as well; new rows only set created_ms.
+    for table in ("rooms", "comments", "votes"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN created_ms INTEGER")
+        c.execute(f"""UPDATE {table} SET created_ms = CAST(ROUND((julianday(created_at) - 2440587.5) * 86400000) AS INTEGER)
+                      WHERE created_at IS NOT NULL""")
+    c.execute("DROP INDEX IF EXISTS idx_comments_room_visible")
+    c.execute("DROP INDEX IF EXISTS idx_comments_room_votes")
+    # popularity order (participant/projector, organizer) and newest first ("新着")
+    c.execute("CREATE INDEX idx_comments_room_visible ON comments(room_code, hidden, votes DESC, created_ms DESC)")
+    c.execute("CREATE INDEX idx_comments_room_votes ON comments(room_code, votes DESC, created_ms DESC)")
+    c.execute("CREATE INDEX idx_comments_room_visible_new ON comments(room_code, hidden, created_ms DESC)")
+    c.execute("CREATE INDEX idx_comments_room_new ON comments(room_code, created_ms DESC)")
+
+def _m006_rotations(c):
+    # projector auto-rotation per room; owner/lease_until_ms elect the single writer (rotation.py)
+    c.execute("""CREATE TABLE IF NOT EXISTS rotations(
+        room_code TEXT PRIMARY KEY,
+        enabled INTEGER NOT NULL DEFAULT 0,
+        interval_s REAL NOT NULL DEFAULT 8,
+        pool_size INTEGER NOT NULL DEFAULT 20,
+        started_ms INTEGER,
+        slot INTEGER,
+        pool TEXT NOT NULL DEFAULT '[]',
+        owner TEXT,
+        lease_until_ms INTEGER
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_rotations_enabled ON rotations(enabled)")
+
+def _m007_comment_tags(c):
+    # one row per (comment, tag) instead of the comma-separated comments.tags, which is emptied
+    # here and no longer written
+    c.execute("""CREATE TABLE IF NOT EXISTS comment_tags(
+        comment_id INTEGER NOT NULL,
+        room_code TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        created_ms INTEGER,
+        PRIMARY KEY (comment_id, tag)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_comment_tags_room_tag ON comment_tags(room_code, tag, comment_id)")
+    rows = c.execute("SELECT id, room_code, tags, created_ms FROM comments WHERE tags<>''").fetchall()
+    c.executemany("INSERT OR IGNORE INTO comment_tags(comment_id, room_code, tag, created_ms) VALUES(?,?,?,?)",
+                  [(r["id"], r["room_code"], t.strip(), r["created_ms"]) for r in rows for t in r["tags"].split(",") if t.strip()])
+    c.execute("UPDATE comments SET tags='' WHERE tags<>''")
+
+def _m008_closed_ms(c):
+    # when a room was closed (retention.py archives rooms closed long ago); rooms closed earlier
+    # get their last activity
+    c.execute("ALTER TABLE rooms ADD COLUMN closed_ms INTEGER")
+    c.execute("""UPDATE rooms SET closed_ms = MAX(COALESCE(created_ms, 0),
+                   COALESCE((SELECT MAX(created_ms) FROM comments WHERE room_code=rooms.code), 0))
+                 WHERE is_closed=1""")
+
+def _m009_focus_revision(c):
+    # focus moves (Focus button, rotation) count here instead of in rooms.revision, so only
+    # projectors rerun for them
+    c.execute("ALTER TABLE rooms ADD COLUMN focus_revision INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [_m001_base, _m002_indexes, _m003_revisions, _m004_fts, _m005_epoch_ms, _m006_rotations,
+              _m007_comment_tags, _m008_closed_ms, _m009_focus_revision]
+SCHEMA_VERSION = len(MIGRATIONS)
+FTS_ENABLED = False
+
+def _migrate(pool, room=None):
+    global FTS_ENABLED
+    with pool.write_lock:   # checked again under the lock: another thread may have done it
+        if pool.migrated: return
+        conn = pool.get_writer()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            c = conn.cursor()
+            version = c.execute("PRAGMA user_version").fetchone()["user_version"]
+            for step in MIGRATIONS[version:]:
+                step(c)
+            if version < SCHEMA_VERSION:
+                c.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            # migrated on a build without FTS5 earlier: retry now
+            FTS_ENABLED = _has_fts(c) or _create_fts(c)
+            if room:   # new room file: start its comment ids in the room's id range
+                c.execute("""INSERT INTO sqlite_sequence(name, seq) SELECT 'comments', ?
+                             WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name='comments')""",
+                          ((int(room) + 1) * SHARD_ID_SPAN,))
+        except BaseException:
+            conn.rollback(); raise
+        conn.commit()
+        pool.migrated = True
+
+def init_db():
+    # cheap after the first call: migrations run at most once per process and file
+    if not _pool.migrated: _migrate(_pool)
+
+# Query shapes issued on every refresh; check_query_plans() asserts none of them scans a table.
+HOT_QUERIES = {
+    "get_comments": ("SELECT * FROM comments WHERE room_code=? AND hidden=0 ORDER BY votes DESC, created_ms DESC", ("000000",)),
+    "get_comments(include_hidden)": ("SELECT * FROM comments WHERE room_code=? ORDER BY votes DESC, created_ms DESC", ("000000",)),
+    "get_comments(order=new)": ("SELECT * FROM comments WHERE room_code=? AND hidden=0 ORDER BY created_ms DESC", ("000000",)),
+    "get_comments(order=new, include_hidden)": ("SELECT * FROM comments WHERE room_code=? ORDER BY created_ms DESC", ("000000",)),
+    "get_comment": ("SELECT * FROM comments WHERE id=?", (0,)),
+    "get_room": ("SELECT * FROM rooms WHERE code=?", ("000000",)),
+    "get_comments_since": ("SELECT * FROM comments WHERE room_code=? AND revision>?", ("000000", 0)),
+    "get_revision": ("SELECT revision FROM rooms WHERE code=?", ("000000",)),
+    "leaderboard": ("SELECT id, votes, created_ms, revision FROM comments WHERE room_code=? AND hidden=0", ("000000",)),
+    "get_rotations": ("SELECT * FROM rotations WHERE enabled=1", ()),
+    "tag_counts": ("""SELECT t.tag, COUNT(*) AS n, SUM(c.hidden=0) AS visible FROM comment_tags t
+                      JOIN comments c ON c.id=t.comment_id WHERE t.room_code=? GROUP BY t.tag""", ("000000",)),
+    "has_voted": ("SELECT 1 FROM votes WHERE room_code=? AND comment_id=? AND voter=?", ("000000", 0, "")),
+    "get_voted_ids": ("SELECT comment_id FROM votes WHERE room_code=? AND voter=?", ("000000", "")),
+}
+
+def check_query_plans(queries=None):
+    # returns {name: [plan lines]} for queries that scan a table or sort in a temp b-tree
+    init_db()
+    bad = {}
+    with get_db() as conn:
+        for name, (sql, args) in (queries or HOT_QUERIES).items():
+            plan = [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, args).fetchall()]
+            if any(d.startswith("SCAN ") or "TEMP B-TREE" in d for d in plan):
+                bad[name] = plan
+    return bad
+
+def now_ms():
+    return int(time.time() * 1000)
+
+@lru_cache(maxsize=4096)
+def hhmm(minute, tz_name):
+    # minute = epoch ms // 60000: one cache entry per displayed minute, shared by every session
+    return datetime.fromtimestamp(minute * 60, tz.gettz(tz_name)).strftime("%H:%M")
+
+def is_valid_code(code:str)->bool:
+    return bool(re.fullmatch(r"\d{6}", code or ""))
+
+@timed
+def ensure_room_by_code(code):
+    with get_db() as conn:
+        return conn.cursor().execute("SELECT * FROM rooms WHERE code=?", (code,)).fetchone()
+
+@timed
+def list_rooms(closed_only=False):
+    # rooms of the catalog, oldest first
+    sql = "SELECT code, title, created_ms, is_closed FROM rooms" + (" WHERE is_closed=1" if closed_only else "")
+    with get_db() as conn:
+        return conn.cursor().execute(sql + " ORDER BY created_ms").fetchall()
+
+# Every write bumps rooms.revision inside its own transaction and stamps the touched comment,
+# so readers can ask for "what changed since revision N" (get_comments_since).
+def _bump(c, room_code, comment_id=None):
+    c.execute("UPDATE rooms SET revision=revision+1 WHERE code=?", (room_code,))
+    row = c.execute("SELECT revision FROM rooms WHERE code=?", (room_code,)).fetchone()
+    rev = row["revision"] if row else 0
+    span = _tx.state[0].get(room_code)
+    if span: span[1] = rev
+    else: _tx.state[0][room_code] = [rev, rev]
+    if comment_id is not None:
+        c.execute("UPDATE comments SET revision=? WHERE id=?", (rev, comment_id))
+        row = c.execute("SELECT id, room_code, votes, hidden, created_ms, revision FROM comments WHERE id=?", (comment_id,)).fetchone()
+        if row: _tx.state[1].append(row)
+    return rev
+
+def _bump_comment(c, comment_id):
+    row = c.execute("SELECT room_code FROM comments WHERE id=?", (comment_id,)).fetchone()
+    return _bump(c, row["room_code"], comment_id) if row else 0
+
+@timed
+def create_room(title, admin_pin=None, code=None, creator_pass=None):
+    if (creator_pass or "") != CREATE_PASS:
+        raise ValueError("作成パスワードが正しくありません。")
+    if code and not is_valid_code(code): raise ValueError("ルームIDは6桁の数字です。")
+    code = code or ''.join(random.choices('0123456789', k=6))
+    with get_db(write=True) as conn:
+        c = conn.cursor()
+        if c.execute("SELECT 1 FROM rooms WHERE code=?", (code,)).fetchone(): raise ValueError("そのルームIDは使用中です。")
+        row = (code, title or "Session", now_ms(), admin_pin or "")
+        c.execute("INSERT INTO rooms(code,title,created_ms,admin_pin) VALUES(?,?,?,?)", row)
+        if SHARDING:   # catalog entry above, the room itself in its own file
+            _pool_for(code, create=True)
+            with get_db(write=True, room=code) as rc:
+                rc.execute("INSERT OR REPLACE INTO rooms(code,title,created_ms,admin_pin) VALUES(?,?,?,?)", row)
+    return code
+
+@timed
+def add_comment(room_code, author, content):
+    if not content or not content.strip(): return
+    with get_db(write=True, room=room_code) as conn:
+        c = conn.cursor()
+        r = c.execute("SELECT is_closed FROM rooms WHERE code=?", (room_code,)).fetchone()
+        if not r or int(r["is_closed"])==1: return
+        c.execute("""INSERT INTO comments(room_code, author, content, created_ms)
+                     VALUES(?,?,?,?)""", (room_code, author or "", content.strip(), now_ms()))
+        _bump(c, room_code, c.lastrowid)
+
+@timed
+def vote_comment(comment_id, delta=1):
+    with get_db(write=True, room=_room_of(comment_id)) as conn:
+        c = conn.cursor()
+        c.execute("UPDATE comments SET votes = COALESCE(votes,0)+? WHERE id=?", (delta, comment_id))
+        _bump_comment(c, comment_id)
+
+@timed
+def _set_focus(c, room_code, comment_id):
+    # bumps focus_revision, not revision: the comment lists stay valid
+    c.execute("UPDATE rooms SET focus_comment_id=?, focus_revision=focus_revision+1 WHERE code=?", (comment_id, room_code))
+    _tx.state[0].setdefault(room_code, None)
+
+def set_focus(room_code, comment_id):
+    with get_db(write=True, room=room_code) as conn:
+        _set_focus(conn.cursor(), room_code, comment_id)
+
+# ---------- Tags ----------
+# comment_tags holds one row per (comment, tag): adding or removing a tag is a single statement,
+# so concurrent organizers cannot overwrite each other. Rows handed out by the read helpers carry
+# "tags" as a list (oldest first).
+@timed
+def tag_comment(comment_id, tag):
+    # -> True if the tag was added, False if the comment already had it (or does not exist)
+    tag = (tag or "").strip()
+    if not tag: return False
+    with get_db(write=True, room=_room_of(comment_id)) as conn:
+        c = conn.cursor()
+        c.execute("""INSERT OR IGNORE INTO comment_tags(comment_id, room_code, tag, created_ms)
+                     SELECT id, room_code, ?, ? FROM comments WHERE id=?""", (tag, now_ms(), comment_id))
+        if c.rowcount != 1: return False
+        _bump_comment(c, comment_id)
+        return True
+
+@timed
+def untag_comment(comment_id, tag):
+    with get_db(write=True, room=_room_of(comment_id)) as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM comment_tags WHERE comment_id=? AND tag=?", (comment_id, (tag or "").strip()))
+        if c.rowcount != 1: return False
+        _bump_comment(c, comment_id)
+        return True
+
+def _with_tags(c, room_code, rows):
+    # fills r["tags"] in place; a few rows are looked up by id, larger sets with one room-wide read
+    if not rows: return rows
+    if len(rows) <= 100:
+        marks = ",".join("?" * len(rows))
+        tag_rows = c.execute(f"SELECT comment_id, tag FROM comment_tags WHERE comment_id IN ({marks}) ORDER BY created_ms",
+                             tuple(r["id"] for r in rows)).fetchall()
+    else:
+        tag_rows = c.execute("SELECT comment_id, tag FROM comment_tags WHERE room_code=? ORDER BY created_ms",
+                             (room_code,)).fetchall()
+    tags = {}
+    for t in tag_rows: tags.setdefault(t["comment_id"], []).append(t["tag"])
+    for r in rows: r["tags"] = tags.get(r["id"], [])
+    return rows
+
+def _tag_counts(c, room_code):
+    # -> {"all": [(tag, comments)], "visible": [(tag, visible comments)]}, most used first
+    rows = c.execute(HOT_QUERIES["tag_counts"][0], (room_code,)).fetchall()
+    order = lambda x: (-x[1], x[0])
+    return {"all": sorted(((r["tag"], r["n"]) for r in rows), key=order),
+            "visible": sorted(((r["tag"], r["visible"]) for r in rows if r["visible"]), key=order)}
+
+@timed
+def tag_counts(room_code, include_hidden=False):
+    # -> [(tag, number of comments)], most used first
+    with get_db(room=room_code) as conn:
+        return _tag_counts(conn.cursor(), room_code)["all" if include_hidden else "visible"]
+
+@timed
+def hide_comment(comment_id, hide=True):
+    with get_db(write=True, room=_room_of(comment_id)) as conn:
+        c = conn.cursor()
+        c.execute("UPDATE comments SET hidden=? WHERE id=?", (1 if hide else 0, comment_id))
+        _bump_comment(c, comment_id)
+
+# The trigram index cannot match shorter terms, so one- and two-character terms (two-kanji words
+# like 事例 included) take the LIKE path: a scan of the room's comments, not of the index.
+FTS_MIN_TERM = 3
+
+def _search_terms(keyword):
+    return [t for t in (keyword or "").split() if t]
+
+def _use_fts(terms):
+    return FTS_ENABLED and terms and all(len(t) >= FTS_MIN_TERM for t in terms)
+
+def _fts_query(terms):
+    # each term as a quoted phrase (substring match with trigram), all terms required
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+ORDERS = {"votes": "votes DESC, created_ms DESC", "new": "created_ms DESC"}
+
+@timed
+def get_comments(room_code, keyword=None, include_hidden=False, order="votes", tag=None):
+    terms = _search_terms(keyword)
+    with get_db(room=room_code) as conn:
+        c = conn.cursor()
+        args = []
+        if _use_fts(terms):
+            sql = "SELECT * FROM comments WHERE id IN (SELECT rowid FROM comments_fts WHERE comments_fts MATCH ?) AND room_code=?"
+            args += [_fts_query(terms), room_code]
+        else:
+            sql = "SELECT * FROM comments WHERE room_code=?"
+            args.append(room_code)
+            for t in terms:
+                sql += " AND content LIKE ?"; args.append(f"%{t}%")
+        if tag:
+            sql += " AND id IN (SELECT comment_id FROM comment_tags WHERE room_code=? AND tag=?)"; args += [room_code, tag]
+        if not include_hidden: sql += " AND hidden=0"
+        sql += " ORDER BY " + ORDERS[order]
+        return _with_tags(c, room_code, c.execute(sql, tuple(args)).fetchall())
+
+@timed
+def search_comments(room_code, keyword, include_hidden=False, limit=300, mark=("[", "]"), order="rank", tag=None):
+    # best matches first (or `order` "votes"/"new", the same order for every term length; "rank"
+    # on the LIKE path is "votes"); rows get "highlighted" (the whole content, matches wrapped in
+    # `mark`) and "rank" (lower is better)
+    terms = _search_terms(keyword)
+    if not terms: return []
+    if not _use_fts(terms):
+        rows = get_comments(room_code, keyword=keyword, include_hidden=include_hidden,
+                            order="votes" if order=="rank" else order, tag=tag)[:limit]
+        pat = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE)
+        return [dict(r, highlighted=pat.sub(lambda m: mark[0] + m.group(0) + mark[1], r["content"]), rank=0.0) for r in rows]
+    sql = """SELECT c.*, highlight(comments_fts, 0, ?, ?) AS highlighted, bm25(comments_fts) AS rank
+             FROM comments_fts JOIN comments c ON c.id = comments_fts.rowid
+             WHERE comments_fts MATCH ? AND c.room_code=?"""
+    args = [mark[0], mark[1], _fts_query(terms), room_code]
+    if tag:
+        sql += " AND c.id IN (SELECT comment_id FROM comment_tags WHERE room_code=? AND tag=?)"; args += [room_code, tag]
+    if not include_hidden: sql += " AND c.hidden=0"
+    sql += " ORDER BY " + ("rank, c.votes DESC" if order=="rank" else ", ".join("c." + o for o in ORDERS[order].split(", "))) + " LIMIT ?"
+    with get_db(room=room_code) as conn:
+        c = conn.cursor()
+        return _with_tags(c, room_code, c.execute(sql, (*args, limit)).fetchall())
+
+@timed
+def get_revision(room_code):
+    with get_db(room=room_code) as conn:
+        row = conn.cursor().execute("SELECT revision FROM rooms WHERE code=?", (room_code,)).fetchone()
+        return row["revision"] if row else 0
+
+@timed
+def get_comments_since(room_code, revision):
+    # -> (rows inserted or changed after `revision`, hidden ones included, current room revision)
+    with get_db(room=room_code) as conn:
+        c = conn.cursor()
+        c.execute("BEGIN")   # one snapshot for both reads
+        row = c.execute("SELECT revision FROM rooms WHERE code=?", (room_code,)).fetchone()
+        current = row["revision"] if row else 0
+        if current == revision: return [], current
+        rows = c.execute("SELECT * FROM comments WHERE room_code=? AND revision>?", (room_code, revision)).fetchall()
+        return _with_tags(c, room_code, rows), current
+
+# ---------- Shared room snapshots ----------
+ROOM_CACHE_SIZE = int(os.getenv("ARS_ROOM_CACHE_SIZE", "64"))   # rooms kept, least recently viewed evicted first
+ROOM_CACHE_TTL = float(os.getenv("ARS_ROOM_CACHE_TTL", "5"))    # seconds; catches writes from other processes
+
+def _load_snapshot(code, prev=None):
+    with get_db(room=code) as conn:
+        c = conn.cursor()
+        c.execute("BEGIN")   # room row and comment delta from one snapshot
+        room = c.execute("SELECT * FROM rooms WHERE code=?", (code,)).fetchone()
+        if not room: return None
+        if prev and prev["revision"] == room["revision"]:
+            return prev if prev["room"]["focus_revision"] == room["focus_revision"] else dict(prev, room=room)
+        since = prev["revision"] if prev else -1
+        delta = _with_tags(c, code, c.execute("SELECT * FROM comments WHERE room_code=? AND revision>?", (code, since)).fetchall())
+        tags = _tag_counts(c, code)
+    rotation = get_rotation(code)   # catalog; set_rotation bumps the room revision
+    by_id = dict(prev["by_id"]) if prev else {}
+    old = [by_id.get(r["id"]) for r in delta]
+    by_id.update((r["id"], r) for r in delta)
+    # the orders are shared by every viewer of the room: a small delta is moved into copies of the
+    # previous lists with bisect (as _Leaderboard does), anything bigger is sorted from scratch
+    if prev and len(delta) * 8 <= len(by_id):
+        orders = {name: (list(keys), list(prev[name])) for name, keys in prev["keys"].items()}
+        for was, r in zip(old, delta):
+            for name, (keys, rows) in orders.items():
+                visible_only = name.startswith("visible")
+                _move(keys, rows, was if was is not None and not (visible_only and was["hidden"]) else None,
+                      None if visible_only and r["hidden"] else r, _ORDER_KEYS[name])
+    else:
+        orders = {}
+        for name, key in _ORDER_KEYS.items():
+            rows = sorted((r for r in by_id.values() if not (name.startswith("visible") and r["hidden"])), key=key)
+            orders[name] = ([key(r) for r in rows], rows)
+    snap = {"room": room, "revision": room["revision"], "by_id": by_id, "rotation": rotation, "tag_counts": tags,
+            "keys": {name: keys for name, (keys, _) in orders.items()}}
+    snap.update((name, rows) for name, (_, rows) in orders.items())
+    return snap
+
+def _rank_key(r):
+    # same order as ORDERS["votes"]; id breaks ties
+    return (-(r["votes"] or 0), -(r["created_ms"] or 0), -r["id"])
+
+def _new_key(r):
+    return (-(r["created_ms"] or 0), -r["id"])
+
+# snapshot list -> sort key; "comments"/"visible" are popularity order, "*_new" newest first
+_ORDER_KEYS = {"comments": _rank_key, "visible": _rank_key, "comments_new": _new_key, "visible_new": _new_key}
+
+def _move(keys, rows, was, r, key):
+    # keys/rows sorted by key: drop the row's previous version `was`, insert `r` (either may be None)
+    if was is not None:
+        i = bisect_left(keys, key(was)); del keys[i]; del rows[i]
+    if r is not None:
+        k = key(r); i = bisect_left(keys, k)
+        keys.insert(i, k); rows.insert(i, r)
+
+class _RoomCache:
+    # One snapshot per room shared by every session of the process. Committed writes bump the
+    # room's generation; the next reader refreshes the snapshot from the revision delta while
+    # other readers of that room wait for the same refresh instead of querying themselves.
+    def __init__(self, size, ttl):
+        self.size, self.ttl = size, ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # code -> (snapshot, generation, loaded_at)
+        self.gens = {}
+        self.room_locks = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def invalidate(self, code):
+        with self.lock:
+            self.gens[code] = self.gens.get(code, 0) + 1
+
+    def _fresh(self, code):
+        # caller holds self.lock
+        ent = self.entries.get(code)
+        if ent and ent[1] == self.gens.get(code, 0) and time.monotonic() - ent[2] < self.ttl:
+            self.entries.move_to_end(code); self.stats["hits"] += 1
+            return ent
+        return None
+
+    def get(self, code):
+        with self.lock:
+            ent = self._fresh(code)
+            if ent: return ent[0]
+            room_lock = self.room_locks.setdefault(code, threading.Lock())
+        with room_lock:
+            with self.lock:
+                ent = self._fresh(code)   # refreshed by another session while we waited
+                if ent: return ent[0]
+                self.stats["misses"] += 1
+                gen = self.gens.get(code, 0)
+                prev = self.entries.get(code)
+            snap = _load_snapshot(code, prev[0] if prev else None)
+            with self.lock:
+                if snap is None:
+                    self.entries.pop(code, None); return None
+                self.entries[code] = (snap, gen, time.monotonic())
+                self.entries.move_to_end(code)
+                while len(self.entries) > self.size:
+                    old, _ = self.entries.popitem(last=False)
+                    self.gens.pop(old, None); self.room_locks.pop(old, None)
+                    self.stats["evictions"] += 1
+            return snap
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear(); self.gens.clear(); self.room_locks.clear()
+
+_room_cache = _RoomCache(ROOM_CACHE_SIZE, ROOM_CACHE_TTL)
+
+@timed
+def get_room_snapshot(room_code):
+    # -> {"room", "revision", "comments" (all, popularity order), "visible", "comments_new" /
+    #     "visible_new" (newest first), "by_id", "rotation", "tag_counts" (see _tag_counts)} or None.
+    # Shared between sessions: treat the rows as read-only.
+    if not room_code: return None
+    return _room_cache.get(room_code)
+
+def room_cache_stats():
+    with _room_cache.lock:
+        return dict(_room_cache.stats, size=len(_room_cache.entries))
+
+# ---------- Leaderboards ----------
+# Per-room popularity ranking of visible comments kept as a sorted key list, updated from the
+# committed rows of each write (no re-sorting) and rebuilt from the DB on first use.
+LEADERBOARD_ROOMS = int(os.getenv("ARS_LEADERBOARD_ROOMS", "64"))
+
+class _Leaderboard:
+    def __init__(self, rows, revision=0):
+        self.revision = revision   # every room change up to this revision is in the board
+        self.checked = time.monotonic()
+        self.by_id = {r["id"]: _rank_key(r) for r in rows}
+        self.revs = {r["id"]: r["revision"] for r in rows}   # revision of the row each entry came from
+        self.keys = sorted(self.by_id.values())
+
+    def put(self, r):
+        if r["revision"] < self.revs.get(r["id"], -1): return   # a later write was applied first
+        self.revs[r["id"]] = r["revision"]
+        self.remove(r["id"])
+        if r["hidden"]: return
+        key = self.by_id[r["id"]] = _rank_key(r)
+        insort(self.keys, key)
+
+    def commit(self, first, last, rows):
+        for r in rows: self.put(r)
+        # a gap means another process wrote in between: the board stays behind until reloaded
+        if first - 1 <= self.revision < last: self.revision = last
+
+    def remove(self, comment_id):
+        key = self.by_id.pop(comment_id, None)
+        if key is not None: del self.keys[bisect_left(self.keys, key)]
+
+    def rank(self, comment_id):
+        key = self.by_id.get(comment_id)
+        return None if key is None else bisect_left(self.keys, key) + 1
+
+class _Leaderboards:
+    # The DB is read outside self.lock (it may open or evict a room file); commits that land while
+    # a board loads are buffered and the ones newer than its snapshot replayed on it. Like
+    # _RoomCache, a board older than the TTL is checked against the room revision and reloaded
+    # when another process has written to the room since.
+    def __init__(self, size, ttl):
+        self.size, self.ttl = size, ttl
+        self.lock = threading.Lock()
+        self.boards = OrderedDict()   # room_code -> _Leaderboard
+        self.load_locks = {}          # room_code -> lock held while that board loads
+        self.pending = {}             # room_code -> [(first, last, rows)] committed during the load
+
+    def _fresh(self, room_code):
+        # caller holds self.lock
+        board = self.boards.get(room_code)
+        if board is not None and time.monotonic() - board.checked < self.ttl:
+            self.boards.move_to_end(room_code); return board
+        return None
+
+    def get(self, room_code):
+        with self.lock:
+            board = self._fresh(room_code)
+            if board: return board
+            load_lock = self.load_locks.setdefault(room_code, threading.Lock())
+        with load_lock:
+            with self.lock:
+                board = self._fresh(room_code)   # loaded by another thread while we waited
+                if board: return board
+                board = self.boards.get(room_code)
+                self.pending[room_code] = []
+            try:
+                with get_db(room=room_code) as conn:
+                    c = conn.cursor()
+                    c.execute("BEGIN")   # rows and revision from one snapshot
+                    rev = c.execute("SELECT revision FROM rooms WHERE code=?", (room_code,)).fetchone()
+                    rev = rev["revision"] if rev else 0
+                    with self.lock: stale = board is None or board.revision < rev
+                    rows = c.execute(HOT_QUERIES["leaderboard"][0], (room_code,)).fetchall() if stale else None
+                with self.lock:
+                    if not stale:
+                        board.checked = time.monotonic()
+                    else:
+                        board = _Leaderboard(rows, rev)
+                        for first, last, done in sorted(self.pending[room_code], key=lambda p: p[0]):
+                            if last > board.revision: board.commit(first, last, [r for r in done if r["revision"] > rev])
+                    self.boards[room_code] = board
+                    self.boards.move_to_end(room_code)
+                    while len(self.boards) > self.size:
+                        old, _ = self.boards.popitem(last=False)
+                        if old not in self.pending: self.load_locks.pop(old, None)
+                    return board
+            finally:
+                with self.lock: self.pending.pop(room_code, None)
+
+    def committed(self, room_code, first, last, rows):
+        with self.lock:
+            board = self.boards.get(room_code)
+            if board is not None: board.commit(first, last, rows)
+            if room_code in self.pending: self.pending[room_code].append((first, last, rows))
+
+    def drop(self, room_code):
+        with self.lock: self.boards.pop(room_code, None)
+
+_leaderboards = _Leaderboards(LEADERBOARD_ROOMS, ROOM_CACHE_TTL)
+
+@timed
+def top_comments(room_code, k=20):
+    # -> [{"id", "votes", "rank"}] for the k most popular visible comments
+    board = _leaderboards.get(room_code)
+    with _leaderboards.lock:
+        return [{"id": -key[2], "votes": -key[0], "rank": i+1} for i, key in enumerate(board.keys[:k])]
+
+@timed
+def comment_rank(room_code, comment_id):
+    # 1-based popularity rank among visible comments, None if hidden/unknown
+    board = _leaderboards.get(room_code)
+    with _leaderboards.lock:
+        return board.rank(comment_id)
+
+@timed
+def get_comment(comment_id):
+    with get_db(room=_room_of(comment_id)) as conn:
+        c = conn.cursor()
+        row = c.execute("SELECT * FROM comments WHERE id=?", (comment_id,)).fetchone()
+        return row and _with_tags(c, row["room_code"], [row])[0]
+
+@timed
+def get_room(room_code):
+    with get_db(room=room_code) as conn:
+        return conn.cursor().execute("SELECT * FROM rooms WHERE code=?", (room_code,)).fetchone()
+
+@timed
+def set_room_closed(room_code, closed:bool):
+    # catalog first, then the room file (the lock order advance_rotation uses too)
+    args = (1 if closed else 0, now_ms() if closed else None, room_code)
+    with get_db(write=True) as cat, get_db(write=True, room=room_code) as conn:
+        c = conn.cursor()
+        c.execute("UPDATE rooms SET is_closed=?, closed_ms=? WHERE code=?", args)
+        if SHARDING: cat.execute("UPDATE rooms SET is_closed=?, closed_ms=? WHERE code=?", args)
+        _bump(c, room_code)
+
+# ---------- Retention ----------
+# retention.py archives rooms closed long ago, then removes them here and compacts the file.
+@timed
+def closed_rooms(before_ms):
+    # catalog rooms closed before `before_ms`, oldest first
+    with get_db() as conn:
+        return conn.cursor().execute("""SELECT code, title, created_ms, closed_ms FROM rooms
+                                        WHERE is_closed=1 AND closed_ms<? ORDER BY closed_ms""", (before_ms,)).fetchall()
+
+@timed
+def delete_room(room_code, chunk=5000):
+    # removes a room and all its rows. The room row goes first (the room is gone for every
+    # reader at once), then its rows in chunks so other rooms' writes are never held up for long;
+    # a room file (ARS_SHARDING) is deleted whole. -> rows deleted
+    flush_votes()
+    with get_db(write=True) as conn:
+        conn.execute("DELETE FROM rotations WHERE room_code=?", (room_code,))
+        deleted = conn.execute("DELETE FROM rooms WHERE code=?", (room_code,)).rowcount
+    path = shard_path(room_code)
+    if SHARDING and os.path.exists(path):
+        with get_db(room=room_code) as conn:
+            deleted += sum(conn.execute(f"SELECT COUNT(*) AS n FROM {t}").fetchone()["n"]
+                           for t in ("comments", "votes", "comment_tags"))
+        _shards.drop(room_code)
+        for f in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(f): os.remove(f)
+    else:
+        for sql, args in (("""DELETE FROM comment_tags WHERE room_code=? AND comment_id IN
+                                (SELECT comment_id FROM comment_tags WHERE room_code=? LIMIT ?)""", (room_code, room_code, chunk)),
+                          ("DELETE FROM votes WHERE rowid IN (SELECT rowid FROM votes WHERE room_code=? LIMIT ?)", (room_code, chunk)),
+                          ("DELETE FROM comments WHERE id IN (SELECT id FROM comments WHERE room_code=? LIMIT ?)", (room_code, chunk))):
+            while True:
+                with get_db(write=True) as conn:
+                    n = conn.execute(sql, args).rowcount
+                deleted += n
+                if n < chunk: break
+    _room_cache.invalidate(room_code)
+    _leaderboards.drop(room_code)
+    return deleted
+
+def compact(vacuum_pages=None):
+    # give the space of deleted rows back to the OS and refresh planner statistics.
+    # A file created before auto_vacuum=INCREMENTAL was on is converted by one full VACUUM.
+    # -> {"mode", "pages_before", "pages_after"}
+    init_db()
+    with _pool.write_lock:
+        conn = _pool.get_writer()
+        pages = lambda: conn.execute("PRAGMA page_count").fetchone()["page_count"]
+        before = pages()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()["auto_vacuum"] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL"); conn.execute("VACUUM")
+            mode = "vacuum"
+        else:
+            # executescript steps the pragma to the end (execute() would free a single page); 0: all free pages
+            conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages or 0)});")
+            mode = "incremental"
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"mode": mode, "pages_before": before, "pages_after": pages()}
+
+
+# ---------- Projector rotation ----------
+# Organizers configure it; the scheduler in rotation.py is the only writer of the rotating focus.
+@timed
+def set_rotation(room_code, enabled, interval_s=8, pool_size=20):
+    # rotations live in the catalog; the room's revision is bumped so viewers pick the change up
+    if float(interval_s) <= 0: raise ValueError("間隔は0秒より長くしてください。")
+    if int(pool_size) <= 0: raise ValueError("対象件数は1件以上にしてください。")
+    with get_db(write=True) as conn, get_db(write=True, room=room_code) as rc:
+        c = conn.cursor()
+        c.execute("""INSERT INTO rotations(room_code, enabled, interval_s, pool_size, started_ms, slot, pool)
+                     VALUES(?,?,?,?,?,NULL,'[]')
+                     ON CONFLICT(room_code) DO UPDATE SET enabled=excluded.enabled, interval_s=excluded.interval_s,
+                       pool_size=excluded.pool_size, started_ms=excluded.started_ms, slot=NULL, pool='[]'""",
+                  (room_code, 1 if enabled else 0, float(interval_s), int(pool_size), now_ms()))
+        _bump(rc.cursor(), room_code)
+
+@timed
+def get_rotation(room_code):
+    with get_db() as conn:
+        return conn.cursor().execute("SELECT * FROM rotations WHERE room_code=?", (room_code,)).fetchone()
+
+@timed
+def get_rotations():
+    # enabled rotations of every room
+    with get_db() as conn:
+        return conn.cursor().execute("SELECT * FROM rotations WHERE enabled=1").fetchall()
+
+@timed
+def advance_rotation(room_code, owner, now, lease_until, slot, pool, focus_id):
+    # claims/renews the lease and records the slot; writes the focus only if this owner still
+    # holds (or may take over) the lease. Returns False when another owner holds it.
+    with get_db(write=True) as conn:
+        c = conn.cursor()
+        c.execute("""UPDATE rotations SET owner=?, lease_until_ms=?, slot=?, pool=?
+                     WHERE room_code=? AND enabled=1 AND (owner=? OR COALESCE(lease_until_ms,0)<?)""",
+                  (owner, lease_until, slot, json.dumps(pool), room_code, owner, now))
+        if c.rowcount != 1: return False
+        with get_db(write=True, room=room_code) as rc:
+            c = rc.cursor()
+            row = c.execute("SELECT focus_comment_id FROM rooms WHERE code=?", (room_code,)).fetchone()
+            if row and row["focus_comment_id"] != focus_id: _set_focus(c, room_code, focus_id)
+        return True
+
+# ---------- Votes (write-behind) ----------
+# "batch": try_vote acknowledges at once and a background thread commits queued votes every
+#          VOTE_FLUSH_MS in one transaction (a crash can lose the last interval's votes).
+# "sync":  every vote is its own transaction, as before.
+VOTE_MODE = os.getenv("ARS_VOTE_MODE", "batch")
+VOTE_FLUSH_MS = int(os.getenv("ARS_VOTE_FLUSH_MS", "250"))
+
+def _write_votes(batch):
+    # batch: {(room_code, comment_id, voter): created_ms}; duplicates already stored are ignored.
+    # One transaction per file: a single one without sharding, one per room with it.
+    files = {}
+    for key, at in batch.items():
+        files.setdefault(key[0] if SHARDING else None, {})[key] = at
+    stored = 0
+    for room, part in files.items():
+        counts = {}
+        with get_db(write=True, room=room) as conn:
+            c = conn.cursor()
+            for (room_code, comment_id, voter), at in part.items():
+                c.execute("INSERT OR IGNORE INTO votes(room_code, comment_id, voter, created_ms) VALUES(?,?,?,?)",
+                          (room_code, comment_id, voter, at))
+                if c.rowcount == 1:
+                    counts[(room_code, comment_id)] = counts.get((room_code, comment_id), 0) + 1
+            for (room_code, comment_id), n in counts.items():
+                c.execute("UPDATE comments SET votes = COALESCE(votes,0)+? WHERE id=?", (n, comment_id))
+                _bump(c, room_code, comment_id)
+        stored += sum(counts.values())
+    return stored
+
+class _VoteQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}   # (room_code, comment_id, voter) -> created_ms
+        self.thread = None
+
+    def add(self, key, created_ms):
+        with self.lock:
+            if key in self.pending: return False
+            self.pending[key] = created_ms
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="ars-votes", daemon=True)
+                self.thread.start()
+        return True
+
+    def contains(self, key):
+        with self.lock: return key in self.pending
+
+    def voted_ids(self, room_code, voter):
+        with self.lock: return {k[1] for k in self.pending if k[0]==room_code and k[2]==voter}
+
+    def _loop(self):
+        try:
+            while True:
+                time.sleep(VOTE_FLUSH_MS/1000)
+                try: self.flush()
+                except Exception: pass   # votes were put back; retried on the next tick
+                with self.lock:
+                    if not self.pending:
+                        self.thread = None; return
+        finally:
+            with self.lock:   # however the thread ends, the next add() starts a new one
+                if self.thread is threading.current_thread(): self.thread = None
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch: return 0
+            try:
+                return _write_votes(batch)
+            except BaseException:
+                with self.lock:
+                    for k, v in batch.items(): self.pending.setdefault(k, v)
+                raise
+
+_votes = _VoteQueue()
+atexit.register(lambda: _votes.flush())   # registered after the pool: runs before it closes
+
+@timed
+def flush_votes():
+    # commit queued votes now; returns the number of new votes stored
+    return _votes.flush()
+
+@timed
+def has_voted(room_code, comment_id, voter):
+    if _votes.contains((room_code, comment_id, voter)): return True
+    with get_db(room=room_code) as conn:
+        c = conn.cursor()
+        row = c.execute("SELECT 1 FROM votes WHERE room_code=? AND comment_id=? AND voter=?",
+                        (room_code, comment_id, voter)).fetchone()
+        return row is not None
+
+@timed
+def get_voted_ids(room_code, voter):
+    # comment ids this voter has voted on in the room (one query for a whole page of cards)
+    if not voter: return set()
+    with get_db(room=room_code) as conn:
+        rows = conn.cursor().execute("SELECT comment_id FROM votes WHERE room_code=? AND voter=?",
+                                     (room_code, voter)).fetchall()
+        return {r["comment_id"] for r in rows} | _votes.voted_ids(room_code, voter)
+
+@timed
+def try_vote(room_code, comment_id, voter):
+    # returns True if vote recorded (batch mode: queued), False if duplicate
+    if not voter: return False
+    now = now_ms()
+    if VOTE_MODE == "batch":
+        if has_voted(room_code, comment_id, voter): return False
+        return _votes.add((room_code, comment_id, voter), now)
+    with get_db(write=True, room=room_code) as conn:
+        c = conn.cursor()
+        try:
+            c.execute("INSERT INTO votes(room_code, comment_id, voter, created_ms) VALUES(?,?,?,?)",
+                      (room_code, comment_id, voter, now))
+        except sqlite3.IntegrityError:
+            return False
+        c.execute("UPDATE comments SET votes = COALESCE(votes,0)+1 WHERE id=?", (comment_id,))
+        _bump(c, room_code, comment_id)
+        return True
+
+@timed
+def set_room_font(room_code, scale:float):
+    with get_db(write=True, room=room_code) as conn:
+        c = conn.cursor()
+        c.execute("UPDATE rooms SET font_scale=? WHERE code=?", (float(scale), room_code))
+        _bump(c, room_code)
+
+
+if __name__ == "__main__":
+    # python db.py : apply migrations and verify that hot queries are index-only lookups
+    bad = check_query_plans()
+    for name, plan in bad.items():
+        print(f"{name}: " + " / ".join(plan))
+    assert not bad, "full scan in hot query"
+    print(f"schema v{SCHEMA_VERSION}: {len(HOT_QUERIES)} hot queries use indexes")
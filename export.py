@@ -0,0 +1,118 @@
+# ARS Canvas v3 — room export (CSV / Parquet)
+# A room is written as one zip with comments, tags and votes (one row per vote). Rows are read
+# from one SQLite snapshot with fetchmany() and written chunk by chunk, so memory stays flat
+# however big the room is; every query follows an index, so SQLite does not sort them either.
+#   python export.py 123456 654321 --format parquet --out data/exports
+#   python export.py --all [--closed]
+import os, io, csv, zipfile, argparse, time, importlib.util
+from datetime import datetime, timezone
+import db
+
+CHUNK = int(os.getenv("ARS_EXPORT_CHUNK", "2000"))   # rows per fetch / parquet row group
+EXPORT_DIR = os.getenv("ARS_EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), "exports"))
+FORMATS = ("csv", "parquet")
+
+_CREATED_AT = "strftime('%Y-%m-%dT%H:%M:%fZ', created_ms/1000.0, 'unixepoch') AS created_at"
+# name -> (query, [(column, parquet type)])
+TABLES = {
+    "room": (f"""SELECT code, title, created_ms, {_CREATED_AT}, is_closed, closed_ms FROM rooms WHERE code=?""",
+             [("code", "string"), ("title", "string"), ("created_ms", "int64"), ("created_at", "string"),
+              ("is_closed", "int64"), ("closed_ms", "int64")]),
+    "comments": (f"""SELECT id, room_code, author, content, votes, hidden, created_ms, {_CREATED_AT}
+                     FROM comments WHERE room_code=? ORDER BY created_ms""",
+                 [("id", "int64"), ("room_code", "string"), ("author", "string"), ("content", "string"),
+                  ("votes", "int64"), ("hidden", "int64"), ("created_ms", "int64"), ("created_at", "string")]),
+    "tags": (f"""SELECT comment_id, tag, created_ms, {_CREATED_AT}
+                 FROM comment_tags WHERE room_code=? ORDER BY tag, comment_id""",
+             [("comment_id", "int64"), ("tag", "string"), ("created_ms", "int64"), ("created_at", "string")]),
+    "votes": (f"""SELECT comment_id, voter, created_ms, {_CREATED_AT}
+                  FROM votes WHERE room_code=? ORDER BY comment_id, voter""",
+              [("comment_id", "int64"), ("voter", "string"), ("created_ms", "int64"), ("created_at", "string")]),
+    # votes rolled up per comment (archives keep these instead of one row per vote)
+    "vote_counts": ("""SELECT comment_id, COUNT(*) AS voters, MIN(created_ms) AS first_ms, MAX(created_ms) AS last_ms
+                       FROM votes WHERE room_code=? GROUP BY comment_id""",
+                    [("comment_id", "int64"), ("voters", "int64"), ("first_ms", "int64"), ("last_ms", "int64")]),
+}
+EXPORT_TABLES = ("comments", "tags", "votes")
+
+def parquet_available():
+    # without importing pyarrow: the settings tab asks on every rerun
+    return importlib.util.find_spec("pyarrow") is not None
+
+def _chunks(cursor, sql, room_code, chunk):
+    cursor.execute(sql, (room_code,))
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows: return
+        yield rows
+
+def _write_csv(f, columns, chunks):
+    out = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")   # BOM: Excel opens it as UTF-8
+    w = csv.DictWriter(out, fieldnames=[c for c, _ in columns])
+    w.writeheader()
+    n = 0
+    for rows in chunks:
+        w.writerows(rows); n += len(rows)
+    out.flush(); out.detach()
+    return n
+
+def _write_parquet(f, columns, chunks):
+    import pyarrow as pa, pyarrow.parquet as pq
+    schema = pa.schema([(c, getattr(pa, t)()) for c, t in columns])
+    n = 0
+    with pq.ParquetWriter(f, schema, compression="zstd") as w:
+        for rows in chunks:
+            w.write_table(pa.Table.from_pylist(rows, schema=schema)); n += len(rows)
+    return n
+
+def export_room(room_code, path=None, fmt="csv", chunk=CHUNK, tables=EXPORT_TABLES):
+    # -> (zip path, {table: rows written}); path defaults to EXPORT_DIR/ars-<room>-<utc time>-<fmt>.zip
+    if fmt not in FORMATS: raise ValueError(f"unknown format: {fmt}")
+    if fmt == "parquet" and not parquet_available(): raise RuntimeError("Parquet export needs pyarrow")
+    db.init_db()
+    db.flush_votes()   # queued votes belong in the export
+    if path is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(EXPORT_DIR, f"ars-{room_code}-{stamp}-{fmt}.zip")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write = _write_csv if fmt == "csv" else _write_parquet
+    counts = {}
+    tmp = path + ".tmp"
+    try:
+        # parquet is compressed already; CSV members are deflated
+        with db.get_db(room=room_code) as conn, \
+             zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED if fmt == "parquet" else zipfile.ZIP_DEFLATED) as z:
+            c = conn.cursor()
+            c.execute("BEGIN")   # all tables from one snapshot
+            for name in tables:
+                sql, columns = TABLES[name]
+                with z.open(f"{room_code}_{name}.{fmt}", "w", force_zip64=True) as f:
+                    counts[name] = write(f, columns, _chunks(c, sql, room_code, chunk))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    return path, counts
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python export.py", description="Export rooms to zip files (CSV or Parquet)")
+    ap.add_argument("rooms", nargs="*", help="room codes")
+    ap.add_argument("--all", action="store_true", help="every room in the catalog")
+    ap.add_argument("--closed", action="store_true", help="with --all: closed rooms only")
+    ap.add_argument("--format", choices=FORMATS, default="csv")
+    ap.add_argument("--out", default=EXPORT_DIR, help="directory for the zip files")
+    ap.add_argument("--chunk", type=int, default=CHUNK)
+    args = ap.parse_args(argv)
+    codes = list(args.rooms)
+    if args.all: codes += [r["code"] for r in db.list_rooms(closed_only=args.closed) if r["code"] not in codes]
+    if not codes: ap.error("give room codes or --all")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    for code in codes:
+        if not db.get_room(code):
+            print(f"{code}: no such room"); continue
+        t0 = time.perf_counter()
+        path, counts = export_room(code, os.path.join(args.out, f"ars-{code}-{stamp}-{args.format}.zip"), args.format, args.chunk)
+        print(f"{code}: {path} " + " ".join(f"{k}={v}" for k, v in counts.items()) + f" ({time.perf_counter()-t0:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# ARS Canvas v3 — per-rerun profiling
+# Off by default (ARS_PROFILE=1 or the organizer 診断 tab switches it on); when off, an
+# instrumented call costs one flag check. DB helpers are wrapped with @timed, render phases use
+# `with phase(...)` or lap(), and each Streamlit rerun is bracketed by begin_rerun()/end_rerun(). Samples
+# are kept per role in rolling windows (quantiles) plus running totals, shown in the 診断 tab and
+# written as Prometheus text to ARS_METRICS_PATH.
+import os, threading, time, functools, tempfile
+from collections import deque
+from contextlib import contextmanager
+
+WINDOW = 500   # latest samples kept per metric
+QUANTILES = (0.5, 0.95, 0.99)
+EXPORT_PATH = os.getenv("ARS_METRICS_PATH",
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ars_metrics.prom"))
+EXPORT_EVERY_S = 10
+
+_enabled = os.getenv("ARS_PROFILE", "0") == "1"
+_local = threading.local()   # .rerun: the Streamlit rerun running on this thread, if any
+_lock = threading.Lock()
+_metrics = {}                # (kind, role, name) -> _Metric
+_last_export = 0.0
+
+class _Metric:
+    __slots__ = ("count", "sum", "rows", "window")
+    def __init__(self):
+        self.count, self.sum, self.rows = 0, 0.0, 0
+        self.window = deque(maxlen=WINDOW)
+
+    def add(self, value, rows=0):
+        self.count += 1; self.sum += value; self.rows += rows
+        self.window.append(value)
+
+    def quantile(self, q):
+        if not self.window: return 0.0
+        v = sorted(self.window)
+        return v[min(len(v)-1, int(q * len(v)))]
+
+def enabled():
+    return _enabled
+
+def set_enabled(on):
+    global _enabled
+    _enabled = bool(on)
+
+def reset():
+    with _lock: _metrics.clear()
+
+def _add(kind, role, name, value, rows=0):
+    with _lock:
+        m = _metrics.get((kind, role, name))
+        if m is None: m = _metrics[(kind, role, name)] = _Metric()
+        m.add(value, rows)
+
+def _rows(result):
+    if isinstance(result, tuple): result = result[0]   # (rows, revision)
+    if isinstance(result, (list, set)): return len(result)
+    return 1 if result else 0
+
+def timed(fn):
+    # decorator for DB helpers: call count, time and rows returned, per role
+    name = fn.__name__
+    @functools.wraps(fn)
+    def wrapper(*args, **kw):
+        if not _enabled: return fn(*args, **kw)
+        t0 = time.perf_counter()
+        result = fn(*args, **kw)
+        ms = (time.perf_counter() - t0) * 1000
+        rows = _rows(result)
+        run = getattr(_local, "rerun", None)
+        if run is not None:
+            calls = run["db"].setdefault(name, [0, 0.0, 0])
+            calls[0] += 1; calls[1] += ms; calls[2] += rows
+        _add("db", run["role"] if run else "background", name, ms, rows)
+        return result
+    return wrapper
+
+@contextmanager
+def phase(name):
+    # time a render phase of the current rerun (or a background job outside reruns)
+    if not _enabled:
+        yield; return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        run = getattr(_local, "rerun", None)
+        if run is not None: run["phases"][name] = run["phases"].get(name, 0.0) + ms
+        else: _add("phase", "background", name, ms)
+
+def begin_rerun(role=None):
+    t0 = time.perf_counter()
+    _local.rerun = {"role": role or "none", "t0": t0, "lap": t0, "db": {}, "phases": {}} if _enabled else None
+
+def set_role(role):
+    run = getattr(_local, "rerun", None)
+    if run is not None: run["role"] = role
+
+def lap(name):
+    # attribute the time since the previous lap (or begin_rerun) to phase `name`; for top-level
+    # script code that cannot be wrapped in `with phase(...)`
+    run = getattr(_local, "rerun", None)
+    if run is None: return
+    now = time.perf_counter()
+    run["phases"][name] = run["phases"].get(name, 0.0) + (now - run["lap"]) * 1000
+    run["lap"] = now
+
+def end_rerun():
+    # fold the rerun into the per-role windows; reruns cut short by st.stop()/st.rerun() are dropped
+    run = getattr(_local, "rerun", None)
+    _local.rerun = None
+    if run is None: return
+    role = run["role"]
+    _add("rerun", role, "total", (time.perf_counter() - run["t0"]) * 1000)
+    _add("rerun", role, "db_calls", sum(c[0] for c in run["db"].values()))
+    _add("rerun", role, "db_ms", sum(c[1] for c in run["db"].values()))
+    for name, ms in run["phases"].items(): _add("phase", role, name, ms)
+    if time.monotonic() - _last_export > EXPORT_EVERY_S:
+        try: write_prometheus()
+        except OSError: pass
+
+def stats():
+    # -> rows for a table: kind, role, name, count, avg, p50/p95/p99 (ms, or calls for db_calls), rows
+    with _lock:
+        items = sorted(_metrics.items())
+        return [{"kind": kind, "role": role, "name": name, "count": m.count,
+                 "avg": round(m.sum / m.count, 3) if m.count else 0.0,
+                 **{f"p{int(q*100)}": round(m.quantile(q), 3) for q in QUANTILES}, "rows": m.rows}
+                for (kind, role, name), m in items]
+
+_PROM = {"db": ("ars_db_call_ms", "DB helper call time (ms)", "fn"),
+         "phase": ("ars_phase_ms", "Render phase time per rerun (ms)", "phase"),
+         "rerun": ("ars_rerun", "Per-rerun totals: total/db_ms in ms, db_calls in calls", "metric")}
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        items = sorted(_metrics.items())
+        for kind, (metric, help_text, label) in _PROM.items():
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} summary"]
+            for (k, role, name), m in items:
+                if k != kind: continue
+                labels = f'role="{role}",{label}="{name}"'
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{{labels},quantile="{q}"}} {m.quantile(q):.3f}')
+                lines.append(f"{metric}_sum{{{labels}}} {m.sum:.3f}")
+                lines.append(f"{metric}_count{{{labels}}} {m.count}")
+        lines += ["# HELP ars_db_rows_total Rows returned by DB helpers", "# TYPE ars_db_rows_total counter"]
+        for (k, role, name), m in items:
+            if k == "db": lines.append(f'ars_db_rows_total{{role="{role}",fn="{name}"}} {m.rows}')
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path=None):
+    # atomic replace so a scraper never reads a half-written file; each writer has its own temp
+    # file, so concurrent exports (reruns, the 診断 button) cannot take each other's
+    global _last_export
+    path = path or EXPORT_PATH
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f: f.write(prometheus_text())
+        os.chmod(tmp, 0o644)   # mkstemp creates it 0600; scrapers may run as another user
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    _last_export = time.monotonic()
+    return path
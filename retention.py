@@ -0,0 +1,56 @@
+# ARS Canvas v3 — retention of closed rooms
+# Rooms closed more than ARS_RETENTION_DAYS ago are written to a compact archive zip (room,
+# comments, tags and per-comment vote counts; Parquet when pyarrow is there) and then removed from
+# the live DB, which is compacted afterwards, so it only grows with the sessions still in use.
+# Run it from cron, e.g. nightly:
+#   python retention.py [--days 90] [--dry-run]
+import os, argparse, time
+import db, export
+
+RETENTION_DAYS = float(os.getenv("ARS_RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.getenv("ARS_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), "archive"))
+ARCHIVE_TABLES = ("room", "comments", "tags", "vote_counts")
+DAY_MS = 86400 * 1000
+
+def archive_room(room_code, out_dir=ARCHIVE_DIR, fmt=None):
+    # -> (archive path, {table: rows})
+    fmt = fmt or ("parquet" if export.parquet_available() else "csv")
+    room = db.get_room(room_code)
+    closed = time.strftime("%Y%m%d", time.gmtime((room["closed_ms"] or 0) / 1000))
+    path = os.path.join(out_dir, f"ars-{room_code}-closed{closed}-{fmt}.zip")
+    return export.export_room(room_code, path, fmt, tables=ARCHIVE_TABLES)
+
+def run(days=RETENTION_DAYS, out_dir=ARCHIVE_DIR, fmt=None, dry_run=False, log=print):
+    # archive and delete rooms closed more than `days` ago, then compact the main DB
+    db.init_db()
+    rooms = db.closed_rooms(db.now_ms() - int(days * DAY_MS))
+    done = []
+    for r in rooms:
+        if dry_run:
+            log(f"{r['code']}: would archive ({r['title']})"); continue
+        path, counts = archive_room(r["code"], out_dir, fmt)
+        # the archive must hold every comment before the room is deleted
+        room_now = db.get_room(r["code"])
+        with db.get_db(room=r["code"]) as conn:
+            live = conn.execute("SELECT COUNT(*) AS n FROM comments WHERE room_code=?", (r["code"],)).fetchone()["n"]
+        if not room_now or room_now["is_closed"] != 1 or counts["comments"] != live:
+            log(f"{r['code']}: changed while archiving, kept"); continue
+        deleted = db.delete_room(r["code"])
+        log(f"{r['code']}: {path} " + " ".join(f"{k}={v}" for k, v in counts.items()) + f", {deleted} live rows deleted")
+        done.append(r["code"])
+    if done:
+        c = db.compact()
+        log(f"compact ({c['mode']}): {c['pages_before']} -> {c['pages_after']} pages")
+    return done
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python retention.py", description="Archive and delete rooms closed long ago")
+    ap.add_argument("--days", type=float, default=RETENTION_DAYS, help="closed for more than this many days")
+    ap.add_argument("--out", default=ARCHIVE_DIR, help="directory for the archive zips")
+    ap.add_argument("--format", choices=export.FORMATS, help="default: parquet if pyarrow is installed")
+    ap.add_argument("--dry-run", action="store_true", help="only list the rooms")
+    args = ap.parse_args(argv)
+    run(args.days, args.out, args.format, args.dry_run)
+
+if __name__ == "__main__":
+    main()
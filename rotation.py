@@ -0,0 +1,56 @@
+# ARS Canvas v3 — projector auto-rotation scheduler
+# Every process runs one scheduler thread, but per room only the holder of the lease in
+# `rotations` writes: it advances rooms.focus_comment_id once per interval through a pool of the
+# room's top comments (db leaderboard), fixed for a whole cycle. Projectors only display the focus.
+import os, socket, threading, time, uuid, json
+from db import get_rotations, advance_rotation, top_comments, comment_rank, now_ms
+
+TICK_S = 1.0
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_ms(interval_s):
+    # outlives a couple of missed ticks; renewed with every slot write
+    return max(15000, int(interval_s * 3000))
+
+def _pool_for(room_code, size):
+    return [t["id"] for t in top_comments(room_code, size)]
+
+def _step(rot, now):
+    lease = lease_ms(rot["interval_s"])
+    held = rot["owner"] == OWNER
+    if not held and (rot["lease_until_ms"] or 0) > now: return   # another process owns this room
+    slot = int((now - rot["started_ms"]) // (rot["interval_s"] * 1000))
+    renew = (rot["lease_until_ms"] or 0) - now < lease / 2
+    if held and slot == rot["slot"] and not renew: return
+    pool = json.loads(rot["pool"] or "[]")
+    if rot["slot"] is None or not pool or slot // len(pool) != rot["slot"] // len(pool):
+        pool = _pool_for(rot["room_code"], rot["pool_size"])   # new cycle: re-rank
+    live = [cid for cid in pool if comment_rank(rot["room_code"], cid)] or _pool_for(rot["room_code"], rot["pool_size"])
+    if not live: return
+    focus = live[slot % len(live)]
+    advance_rotation(rot["room_code"], OWNER, now, now + lease, slot, pool, focus)
+
+class _Scheduler(threading.Thread):
+    def __init__(self):
+        super().__init__(name="ars-rotation", daemon=True)
+
+    def run(self):
+        while True:
+            try:
+                now = now_ms()
+                for rot in get_rotations():
+                    try: _step(rot, now)
+                    except Exception: pass   # one bad room must not stop the others; retried next tick
+            except Exception:
+                pass   # retried on the next tick
+            time.sleep(TICK_S)
+
+_scheduler = None
+_lock = threading.Lock()
+
+def start_scheduler():
+    # idempotent; called on every app run
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = _Scheduler(); _scheduler.start()